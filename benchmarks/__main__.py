@@ -0,0 +1,15 @@
+"""Run all benchmarks and emit the results as JSON.
+
+    python -m benchmarks [--filter REGEX] [--quick] [--output FILE]
+
+Progress is logged to stderr, the JSON goes to stdout unless an output
+file is given.
+"""
+import logging
+
+from . import bench_hash, bench_codecs, bench_pipeline, bench_report
+from .harness import main
+
+logging.getLogger("ckpt").setLevel(logging.WARNING)
+
+main()
@@ -0,0 +1,165 @@
+"""Throughput of the checkpoint codecs, and of saving and loading
+checkpoints with them.
+
+Run with `python -m benchmarks.bench_codecs`.
+"""
+import os
+import pickle
+import shutil
+import tempfile
+
+import numpy as np
+
+from ckpt.codecs import get_codecs, get_codec
+from ckpt.checkpoint import Checkpoint
+from ckpt.misc import set_ckpt_path, get_ckpt_path
+
+from .harness import benchmark, main
+
+def make_model():
+    rng = np.random.RandomState(0)
+
+    # Roughly what a pickled tree ensemble looks like: many small
+    # integer and float arrays.
+    return [{"children_left": rng.randint(-1, 1000, 2000),
+             "children_right": rng.randint(-1, 1000, 2000),
+             "feature": rng.randint(0, 50, 2000),
+             "threshold": rng.random_sample(2000).round(3),
+             "value": rng.random_sample((2000, 1, 2))}
+            for _ in range(100)]
+
+def make_payload(name):
+    rng = np.random.RandomState(0)
+
+    if name == "model":
+        return pickle.dumps(make_model(), protocol=pickle.HIGHEST_PROTOCOL)
+    elif name == "float array":
+        return rng.random_sample(2**22).tobytes()
+    else:
+        return (rng.random_sample(2**22) > 0.9).astype(np.float64).tobytes()
+
+def configurations():
+    for name in sorted(get_codecs()):
+        yield name
+
+        if name in ("gzip", "zstd"):
+            yield "{}:1".format(name)
+
+def parse_codec(spec):
+    name, _, level = spec.partition(":")
+
+    return get_codec(name, level=int(level) if level else None)
+
+def tempdir():
+    """Use a fresh ckpt path, and restore the old one afterwards."""
+    old_path = get_ckpt_path()
+    path = tempfile.mkdtemp()
+    set_ckpt_path(path)
+
+    return old_path, path
+
+def cleanup(old_path, path):
+    set_ckpt_path(old_path)
+    shutil.rmtree(path)
+
+@benchmark("codecs.write", payload=["model", "float array", "sparse-ish"],
+           codec=list(configurations()))
+def bench_write(payload, codec):
+    data = make_payload(payload)
+    codec = parse_codec(codec)
+    path = tempfile.mkdtemp()
+    filename = os.path.join(path, "payload" + codec.suffix)
+
+    def write():
+        with codec.open(filename, "wb") as fd:
+            fd.write(data)
+
+    yield write
+
+    shutil.rmtree(path)
+
+@benchmark("codecs.read", payload=["model", "float array", "sparse-ish"],
+           codec=list(configurations()))
+def bench_read(payload, codec):
+    data = make_payload(payload)
+    codec = parse_codec(codec)
+    path = tempfile.mkdtemp()
+    filename = os.path.join(path, "payload" + codec.suffix)
+
+    with codec.open(filename, "wb") as fd:
+        fd.write(data)
+
+    def read():
+        with codec.open(filename, "rb") as fd:
+            fd.read()
+
+    yield read
+
+    shutil.rmtree(path)
+
+@benchmark("checkpoint.save_model", codec=sorted(get_codecs()))
+def bench_save_model(codec):
+    model = make_model()
+    state = tempdir()
+    count = iter(range(10**9))
+
+    def save():
+        with Checkpoint("model", [str(next(count))], quiet=True,
+                        codec=codec) as ckpt:
+            with ckpt.open_file("model", "wb") as fd:
+                pickle.dump(model, fd, protocol=pickle.HIGHEST_PROTOCOL)
+
+    yield save
+
+    cleanup(*state)
+
+@benchmark("checkpoint.load_model", codec=sorted(get_codecs()))
+def bench_load_model(codec):
+    state = tempdir()
+
+    with Checkpoint("model", [], quiet=True, codec=codec) as ckpt:
+        with ckpt.open_file("model", "wb") as fd:
+            pickle.dump(make_model(), fd, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load():
+        with Checkpoint("model", [], quiet=True, codec=codec) as ckpt:
+            with ckpt.open_file("model", "rb") as fd:
+                pickle.load(fd)
+
+    yield load
+
+    cleanup(*state)
+
+@benchmark("checkpoint.save_array", size=[2**20, 2**24, 2**27])
+def bench_save_array(size):
+    X = np.random.random_sample(size // 8)
+    state = tempdir()
+    count = iter(range(10**9))
+
+    def save():
+        with Checkpoint("array", [str(next(count))], quiet=True) as ckpt:
+            ckpt.save_array("X", X)
+
+    yield save
+
+    cleanup(*state)
+
+@benchmark("checkpoint.load_array", size=[2**20, 2**24, 2**27],
+           mmap=[True, False])
+def bench_load_array(size, mmap):
+    state = tempdir()
+
+    with Checkpoint("array", [], quiet=True) as ckpt:
+        ckpt.save_array("X", np.random.random_sample(size // 8))
+
+    def load():
+        with Checkpoint("array", [], quiet=True) as ckpt:
+            # Touch the data, so mapped arrays are actually read
+            ckpt.load_array("X", mmap_mode="r" if mmap else None).sum()
+
+    yield load
+
+    cleanup(*state)
+
+if __name__ == "__main__":
+    main(pattern="^(codecs|checkpoint)\\.")
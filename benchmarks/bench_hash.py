@@ -0,0 +1,34 @@
+"""Compare `misc.get_hash` (pickle + sha256) with streaming fingerprints.
+
+Run with `python -m benchmarks.bench_hash`.
+"""
+import numpy as np
+
+from ckpt.misc import get_hash
+from ckpt.fingerprint import fingerprint, get_hashers
+
+from .harness import benchmark, main
+
+SIZES = [2**20, 2**24, 2**27]
+
+def make_data(size):
+    X = np.random.random_sample(size // 8)
+    y = np.arange(X.shape[0] // 16)
+
+    return X.reshape((-1, 16)), y
+
+@benchmark("hash.get_hash", repeat=3, memory=True, size=SIZES)
+def bench_get_hash(size):
+    data = make_data(size)
+
+    yield lambda: get_hash(data)
+
+@benchmark("hash.fingerprint", repeat=3, memory=True, size=SIZES,
+           hasher=sorted(get_hashers()))
+def bench_fingerprint(size, hasher):
+    data = make_data(size)
+
+    yield lambda: fingerprint(data, hasher)
+
+if __name__ == "__main__":
+    main(pattern="^hash\\.")
@@ -0,0 +1,129 @@
+"""Fitting pipes and pipelines with and without checkpoints.
+
+Run with `python -m benchmarks.bench_pipeline`.
+"""
+import pickle
+
+import numpy as np
+
+from ckpt.base import Transformer, Predictor
+from ckpt.pipeline import Pipeline
+from ckpt.checkpoint import Checkpoint
+from ckpt.cache import enable_model_cache, disable_model_cache
+
+from .harness import benchmark, main
+from .bench_codecs import tempdir, cleanup
+
+class Center(Transformer):
+    def __init__(self, offset=0):
+        self.offset = offset
+
+    def fit(self, X, y):
+        self.mean = X.mean(axis=0) + self.offset
+
+    def transform(self, X, y=None):
+        return X - self.mean, y
+
+    def load_model(self, ckpt):
+        self.mean = ckpt.load_array("mean")
+
+    def save_model(self, ckpt):
+        ckpt.save_array("mean", self.mean)
+
+class LeastSquares(Predictor):
+    def __init__(self, alpha=1.0):
+        self.alpha = alpha
+
+    def fit(self, X, y):
+        self.coef = np.linalg.solve(X.T @ X + self.alpha * np.eye(X.shape[1]),
+                                    X.T @ y)
+
+    def predict(self, X):
+        return X @ self.coef
+
+    def load_model(self, ckpt):
+        with ckpt.open_file("model", "rb") as fd:
+            self.coef = pickle.load(fd)
+
+    def save_model(self, ckpt):
+        with ckpt.open_file("model", "wb") as fd:
+            pickle.dump(self.coef, fd, protocol=pickle.HIGHEST_PROTOCOL)
+
+def make_data(rows):
+    rng = np.random.RandomState(0)
+    X = rng.random_sample((rows, 32))
+
+    return X, X @ rng.random_sample(32)
+
+def make_pipeline(offset=0):
+    return Pipeline([("center", Center(offset)),
+                     ("model", LeastSquares())])
+
+@benchmark("pipe.fit", rows=[10**4, 10**6],
+           mode=["cold", "warm", "memory", "no checkpoints"])
+def bench_pipe_fit(rows, mode):
+    """`cold` fits and saves a new checkpoint every time, `warm` loads
+    it, `memory` gets it from the model cache."""
+    X, y = make_data(rows)
+    state = tempdir()
+    count = iter(range(10**9))
+
+    if mode == "memory":
+        enable_model_cache()
+
+    if mode in ("warm", "memory"):
+        LeastSquares()._fit(X, y, True)
+
+    def fit():
+        alpha = next(count) if mode == "cold" else 1.0
+        LeastSquares(alpha)._fit(X, y, mode != "no checkpoints")
+
+    yield fit
+
+    disable_model_cache()
+    cleanup(*state)
+
+@benchmark("pipeline.fit", rows=[10**4, 10**6], mode=["cold", "warm"])
+def bench_pipeline_fit(rows, mode):
+    X, y = make_data(rows)
+    state = tempdir()
+    count = iter(range(1, 10**9))
+
+    make_pipeline().fit(X, y)
+
+    def fit():
+        make_pipeline(next(count) if mode == "cold" else 0).fit(X, y)
+
+    yield fit
+
+    cleanup(*state)
+
+@benchmark("sklearn.roundtrip", trees=[10, 100])
+def bench_sklearn_roundtrip(trees):
+    from sklearn.ensemble import RandomForestClassifier
+    from ckpt.sklearn import wrap
+
+    rng = np.random.RandomState(0)
+    X = rng.random_sample((2000, 20))
+    y = rng.randint(0, 2, 2000)
+    state = tempdir()
+    count = iter(range(10**9))
+
+    pipe = wrap(RandomForestClassifier)(n_estimators=trees, random_state=0)
+    pipe.fit(X, y)
+
+    def roundtrip():
+        ckpt = Checkpoint("roundtrip", [str(next(count))], quiet=True)
+
+        with ckpt:
+            pipe.save_model(ckpt)
+
+        with ckpt:
+            pipe.load_model(ckpt)
+
+    yield roundtrip
+
+    cleanup(*state)
+
+if __name__ == "__main__":
+    main(pattern="^(pipe|pipeline|sklearn)\\.")
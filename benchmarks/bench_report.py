@@ -0,0 +1,126 @@
+"""`ckpt report` over synthetic stores of experiments.
+
+Run with `python -m benchmarks.bench_report`.
+"""
+import os
+import atexit
+import shutil
+import hashlib
+
+import numpy as np
+
+from ckpt.misc import get_ckpt_path, set_ckpt_path, mkdirp
+from ckpt.results import save_experiment
+
+from .harness import benchmark, main
+from .bench_codecs import tempdir
+
+SIZES = [1000, 10000, 100000]
+
+def accuracy(y_true, y_pred):
+    return float(np.mean(y_true == y_pred))
+
+def make_store(n):
+    rng = np.random.RandomState(0)
+    path = os.path.join(get_ckpt_path(), "experiments")
+
+    mkdirp(path)
+
+    for i in range(n):
+        config = {"scale": {"factor": int(rng.randint(1, 10))},
+                  "model": {"alpha": float(rng.random_sample()),
+                            "seed": i}}
+        y_true = rng.randint(0, 2, 100)
+        ex_id = hashlib.sha256(str(i).encode("utf-8")).hexdigest()
+
+        save_experiment(os.path.join(path, "{}.json".format(ex_id)),
+                        {"config": config,
+                         "metadata": {"name": "synthetic", "start": i},
+                         "results": {"dev": {"y_true": y_true,
+                                             "y_pred": rng.permutation(
+                                                 y_true)}}})
+
+# Stores are built once per size and shared by the benchmarks, as
+# building the larger ones takes minutes.
+stores = {}
+
+def get_store(n):
+    if n not in stores:
+        state = tempdir()
+        make_store(n)
+        set_ckpt_path(state[0])
+        stores[n] = state[1]
+
+    return stores[n]
+
+@atexit.register
+def remove_stores():
+    for path in stores.values():
+        shutil.rmtree(path, ignore_errors=True)
+
+def setup(n):
+    from ckpt.experiment import add_metric, get_metrics
+
+    old_path = get_ckpt_path()
+    metrics = dict(get_metrics())
+
+    set_ckpt_path(get_store(n))
+    get_metrics().clear()
+    add_metric("acc", accuracy)
+
+    return old_path, metrics
+
+def sync():
+    from ckpt.index import ExperimentIndex
+    from ckpt.experiment import get_metrics
+
+    with ExperimentIndex() as index:
+        index.sync(get_metrics())
+
+def teardown(old_path, metrics):
+    from ckpt.experiment import get_metrics
+
+    get_metrics().clear()
+    get_metrics().update(metrics)
+    set_ckpt_path(old_path)
+
+@benchmark("report.reindex", repeat=1, experiments=SIZES)
+def bench_reindex(experiments):
+    """Index every experiment and compute its metrics from scratch."""
+    from ckpt.report import rebuild_index
+
+    state = setup(experiments)
+
+    yield rebuild_index
+
+    teardown(*state)
+
+@benchmark("report.tabulate", repeat=3, experiments=SIZES,
+           limit=[20, None])
+def bench_tabulate(experiments, limit):
+    """A report over an up to date index."""
+    from ckpt.report import get_experiments, tabulate_data
+
+    state = setup(experiments)
+    sync()
+
+    yield lambda: tabulate_data(get_experiments(), "dev-acc", limit=limit)
+
+    teardown(*state)
+
+@benchmark("report.resolve", repeat=3, experiments=SIZES)
+def bench_resolve(experiments):
+    """Reporting a handful of experiments by short id."""
+    from ckpt.report import get_experiments, tabulate_data
+
+    state = setup(experiments)
+    sync()
+    ids = [hashlib.sha256(str(i).encode("utf-8")).hexdigest()[:7]
+           for i in range(0, experiments, experiments // 10)]
+
+    yield lambda: tabulate_data(get_experiments(ids), "dev-acc")
+
+    teardown(*state)
+
+if __name__ == "__main__":
+    main(pattern="^report\\.")
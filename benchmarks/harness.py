@@ -0,0 +1,150 @@
+"""Minimal benchmark harness.
+
+Benchmarks are generator functions registered with `benchmark`. The
+code before the `yield` sets up, the yielded callable is timed, and
+the code after it tears down:
+
+    @benchmark("hash.fingerprint", size=[2**20, 2**24])
+    def bench_fingerprint(size):
+        data = np.zeros(size // 8)
+        yield lambda: fingerprint(data)
+
+Every combination of params is run, and results are emitted as JSON
+so they can be compared across commits.
+"""
+import os
+import re
+import sys
+import argparse
+import time
+import json
+import socket
+import platform
+import itertools
+import statistics
+import subprocess
+import tracemalloc
+import traceback
+
+from collections import OrderedDict
+
+benchmarks = OrderedDict()
+
+def benchmark(name, repeat=5, memory=False, **params):
+    """Register a benchmark. `params` maps argument names to lists of
+    values to run it with. With `memory`, the peak memory allocated by
+    Python during one extra run is measured too."""
+    def decorator(fn):
+        benchmarks[name] = {"fn": fn, "repeat": repeat, "memory": memory,
+                            "params": params}
+        return fn
+
+    return decorator
+
+def get_combinations(params, quick=False):
+    if quick:
+        params = {key: values[:1] for key, values in params.items()}
+
+    keys = sorted(params)
+
+    for values in itertools.product(*(params[key] for key in keys)):
+        yield OrderedDict(zip(keys, values))
+
+def measure(fn, params, repeat, memory):
+    gen = fn(**params)
+    run = next(gen)
+
+    try:
+        times = []
+
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+
+        result = {"min": min(times),
+                  "median": statistics.median(times),
+                  "mean": statistics.mean(times)}
+
+        if memory:
+            tracemalloc.start()
+            run()
+            result['peak'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        return result
+    finally:
+        gen.close()
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                       cwd=os.path.dirname(__file__),
+                                       stderr=subprocess.DEVNULL,
+                                       universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(pattern=None, quick=False, repeat=None, log=sys.stderr):
+    results = []
+
+    for name, bench in benchmarks.items():
+        if pattern and not re.search(pattern, name):
+            continue
+
+        for params in get_combinations(bench['params'], quick):
+            result = OrderedDict((("name", name), ("params", params)))
+
+            try:
+                result.update(measure(bench['fn'], params,
+                                      repeat or bench['repeat'],
+                                      bench['memory']))
+            except Exception:
+                result['error'] = traceback.format_exc(limit=-1).strip()
+
+            results.append(result)
+
+            if log:
+                print(format_result(result), file=log)
+
+    return {"commit": get_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "host": socket.gethostname(),
+            "timestamp": time.time(),
+            "results": results}
+
+def format_result(result):
+    label = "{} {}".format(result['name'], " ".join(
+        "{}={}".format(key, value) for key, value in result['params'].items()))
+
+    if "error" in result:
+        return "{:<60} error: {}".format(label,
+                                         result['error'].splitlines()[-1])
+
+    line = "{:<60} {:>10.4f}s".format(label, result['median'])
+
+    if "peak" in result:
+        line += " {:>10.2f}MB".format(result['peak'] / 2**20)
+
+    return line
+
+def main(argv=None, pattern=None):
+    parser = argparse.ArgumentParser(description="Run ckpt benchmarks")
+    parser.add_argument("--filter", "-k", default=pattern,
+                        help="Only run benchmarks matching this regex")
+    parser.add_argument("--quick", "-q", action="store_true",
+                        help="Only run the first value of each param")
+    parser.add_argument("--repeat", "-r", type=int, default=None)
+    parser.add_argument("--output", "-o", default=None,
+                        help="Write JSON results here instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.filter, args.quick, args.repeat)
+
+    if args.output:
+        with open(args.output, "w") as fd:
+            json.dump(report, fd, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
@@ -1,3 +1,18 @@
-from .experiment import Experiment
-from .checkpoint import Checkpoint
-from .misc import add_defaults
+import importlib
+
+# Imported on first use, so that e.g. the command line doesn't pay for
+# modules it doesn't need.
+exports = {"Experiment": "experiment",
+           "Checkpoint": "checkpoint",
+           "add_defaults": "misc"}
+
+def __getattr__(name):
+    if name in exports:
+        return getattr(importlib.import_module("." + exports[name],
+                                               __name__), name)
+
+    raise AttributeError("module {!r} has no attribute {!r}"
+                         .format(__name__, name))
+
+def __dir__():
+    return sorted(list(globals()) + list(exports))
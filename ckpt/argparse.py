@@ -1,9 +1,13 @@
 import argparse
 import sys
+import json
 import os.path
-from .misc import get_ckpt_path, get_long_hash, save_as_csv
-from .report import (get_experiments, tabulate_data, remove_experiment,
-                     pretty_print, inspect_experiment)
+from .misc import (get_ckpt_path, get_long_hash, save_as_csv, parse_size,
+                   format_size, AmbiguousIdError)
+from .store import POLICIES
+
+# Commands import what they need when they run, so light commands such
+# as `remove` don't import numpy and friends.
 
 def is_bool(item):
     item = item.lower()
@@ -35,7 +39,12 @@ class Parser(object):
                                ("report", "Report experiments"),
                                ("rerun", "Rerun experiment"),
                                ("remove", "Remove experiment"),
-                               ("inspect", "Inspect experiment")):
+                               ("inspect", "Inspect experiment"),
+                               ("reindex", "Rebuild experiment index"),
+                               ("gc", "Evict checkpoints to fit budget"),
+                               ("du", "Show checkpoint disk usage"),
+                               ("profile", "Show where experiments spent "
+                                "their time")):
             self.subparsers[name] = self.commands.add_parser(name, help=help_str)
 
         self.subparsers['report'].add_argument("--output-format", "-o",
@@ -49,13 +58,41 @@ class Parser(object):
                                                default=None)
         self.subparsers['report'].add_argument("--config", "-c",
                                                nargs='*', default=[])
-
-
+        self.subparsers['report'].add_argument("--jobs", "-j", type=int,
+                                               default=1)
+        self.subparsers['report'].add_argument("--limit", "-n", type=int,
+                                               default=None)
+        self.subparsers['reindex'].add_argument("--jobs", "-j", type=int,
+                                                default=1)
+
+
+
+        self.subparsers['run'].add_argument("config",
+                                            help="Pipeline config, list of "
+                                            "configs or grid")
+        self.subparsers['run'].add_argument("--jobs", "-j", type=int,
+                                            default=1)
+        self.subparsers['run'].add_argument("--repeat", "-r", type=int,
+                                            default=1)
+        self.subparsers['run'].add_argument("--dry-run", action="store_true")
+        self.subparsers['run'].add_argument("--no-checkpoints",
+                                            dest="checkpoints",
+                                            action="store_false")
+
+        self.subparsers['gc'].add_argument("--policy", "-p",
+                                           choices=POLICIES, default="lru")
+        self.subparsers['gc'].add_argument("--budget", "-b", type=parse_size,
+                                           default=None,
+                                           help="Store size, e.g. 50G. "
+                                           "Defaults to checkpoints.budget "
+                                           "in the config file")
+        self.subparsers['gc'].add_argument("--dry-run", action="store_true")
 
         self.subparsers['rerun'].add_argument("experiment_id")
         self.subparsers['remove'].add_argument("experiment_id", nargs='+')
         self.subparsers['report'].add_argument("experiment_id", nargs='*')
         self.subparsers['inspect'].add_argument("experiment_id")
+        self.subparsers['profile'].add_argument("experiment_id", nargs='+')
 
 
     def get_subparser(self, name):
@@ -64,18 +101,53 @@ class Parser(object):
     def parse_args(self):
         return self.parser.parse_args()
 
-    def run(self):
+    def run(self, pipes=None, load_data=None, run=None):
+        """Run the command line.
+
+        `run` and `rerun` need the experiment's `pipes`, `load_data`
+        and `run`, see `ckpt.sweep.run_sweep`. Without them, the parsed
+        arguments are returned to the calling script.
+        """
         args = self.parse_args()
 
+        try:
+            args = self.run_command(args)
+        except AmbiguousIdError as err:
+            self.parser.error(str(err))
+
+        if run is not None and args.command in ("run", "rerun"):
+            self.run_sweep(args, pipes, load_data, run)
+
+        return args
+
+    def run_sweep(self, args, pipes, load_data, run):
+        from .sweep import run_sweep
+
+        configs = args.configs * args.repeat
+
+        if args.dry_run:
+            for config in configs:
+                print(json.dumps(config))
+            sys.exit(0)
+
+        failures = run_sweep(configs, pipes, load_data, run, args.jobs,
+                             use_checkpoints=args.checkpoints)
+
+        sys.exit(1 if failures else 0)
+
+    def run_command(self, args):
         if args.command == "report":
+            from .report import get_experiments, tabulate_data, pretty_print
+
             config = {key: autotype(value)
                       for key, value in
                       (item.split(":") for item in args.config)}
             print(config)
 
             data, headers = tabulate_data(get_experiments(args.experiment_id,
-                                                          args.pipe, config),
-                                          args.sort_by)
+                                                          args.pipe, config,
+                                                          args.jobs),
+                                          args.sort_by, limit=args.limit)
 
             if args.output_format == "csv":
                 save_as_csv(data, args.filename, headers)
@@ -83,9 +155,69 @@ class Parser(object):
                 pretty_print(data, headers)
             sys.exit(0)
         elif args.command == "inspect":
+            from .report import inspect_experiment
+
             inspect_experiment(args.experiment_id)
             sys.exit(0)
+        elif args.command == "run":
+            from .sweep import load_sweep
+
+            # Executed with the calling script's functions, see `run`
+            args.configs = load_sweep(args.config)
+            args.n = None
+        elif args.command == "gc":
+            from .store import CheckpointStore
+
+            with CheckpointStore() as store:
+                try:
+                    entries = store.gc(args.budget, args.policy, args.dry_run)
+                except ValueError as err:
+                    self.parser.error(str(err))
+
+                for entry in entries:
+                    print("{} {:>8} {}".format(entry['hash'],
+                                               format_size(entry['size']),
+                                               entry['name'] or ""))
+
+                size = format_size(sum(entry['size'] for entry in entries))
+
+                if args.dry_run:
+                    print("Would evict {} checkpoints ({}) of {}"
+                          .format(len(entries), size,
+                                  format_size(store.get_size())))
+                else:
+                    print("Evicted {} checkpoints ({}), store is now {}"
+                          .format(len(entries), size,
+                                  format_size(store.get_size())))
+            sys.exit(0)
+        elif args.command == "profile":
+            from .report import profile_experiments
+
+            profile_experiments(args.experiment_id)
+            sys.exit(0)
+        elif args.command == "du":
+            from .blobs import disk_usage
+
+            usage = disk_usage()
+            saved = usage['logical'] - usage['physical']
+
+            print("Logical  {:>8} in {} files".format(
+                format_size(usage['logical']), usage['files']))
+            print("Physical {:>8} in {} blobs ({} unreferenced)".format(
+                format_size(usage['physical']), usage['blobs'],
+                usage['unreferenced']))
+            print("Saved    {:>8} ({:.0%})".format(
+                format_size(max(saved, 0)),
+                max(saved, 0) / usage['logical'] if usage['logical'] else 0))
+            sys.exit(0)
+        elif args.command == "reindex":
+            from .report import rebuild_index
+
+            rebuild_index(args.jobs)
+            sys.exit(0)
         elif args.command == "rerun":
+            from .sweep import load_sweep
+
             long_hash = get_long_hash(args.experiment_id)
             args.config = os.path.join(get_ckpt_path(), "experiments",
                                        long_hash)
@@ -93,7 +225,11 @@ class Parser(object):
             args.checkpoints = False
             args.repeat = 1
             args.n = None
+            args.jobs = 1
+            args.configs = load_sweep(args.config)
         elif args.command == "remove":
+            from .report import remove_experiment
+
             for ex_id in args.experiment_id:
                 filename = get_long_hash(ex_id)
                 if filename:
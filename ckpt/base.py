@@ -1,11 +1,26 @@
 from abc import ABC, abstractmethod
 from .checkpoint import Checkpoint
-from .misc import get_hash
+from .misc import get_hash, is_array
+from .fingerprint import fingerprint
+from .cache import get_model_cache, Snapshot
+from .writer import get_writer
+from .profile import profile
 
+import copy
+import pickle
 import logging
 import inspect
 
 class Pipe(ABC):
+    # Codec used for the pipe's checkpoint files, see `ckpt.codecs`.
+    # Defaults to `ckpt.codecs.default_codec`.
+    codec = None
+
+    # Whether the pipe changes the arrays of its model in place after
+    # fitting, so models from the model cache must be copied, see
+    # `ckpt.cache`.
+    mutates_model = False
+
     def get_default_params(self):
         params = inspect.signature(self.__init__).parameters
 
@@ -25,6 +40,15 @@ class Pipe(ABC):
     def fit(self, X, y):
         pass
 
+    def partial_fit(self, X, y, **kwargs):
+        raise NotImplementedError("{} does not support partial_fit"
+                                  .format(self.get_name()))
+
+    def fit_chunks(self, chunks, **kwargs):
+        """Fit on an iterable of `(X, y)` chunks with `partial_fit`."""
+        for X, y in chunks:
+            self.partial_fit(X, y, **kwargs)
+
     @abstractmethod
     def load_model(self, ckpt):
         pass
@@ -33,24 +57,104 @@ class Pipe(ABC):
     def save_model(self, ckpt):
         pass
 
-    def _fit(self, X, y, use_checkpoints):
-        if use_checkpoints:
-            dependencies = [get_hash(sorted(self.get_params().items())),
-                            get_hash((X, y))]
-
-            with Checkpoint("{}.fit".format(self.get_name()),
-                            dependencies) as ckpt:
-                if ckpt.exists():
-                    ckpt.logger.info("Loading checkpoint for {} from {}"
-                                     .format(ckpt.name, ckpt.get_path()))
+    def get_model(self):
+        """The fitted state of the pipe, as kept in the model cache."""
+        return dict(vars(self))
+
+    def set_model(self, model):
+        vars(self).update(model)
+
+    def get_checkpoint(self, data_hash=None, parent=None):
+        dependencies = [get_hash(sorted(self.get_params().items()))]
+
+        if data_hash:
+            dependencies.append(data_hash)
+
+        return Checkpoint("{}.fit".format(self.get_name()),
+                          dependencies, parent=parent, codec=self.codec)
+
+    def _fit_checkpoint(self, ckpt, get_data, stream=False, **fit_params):
+        cache = get_model_cache()
+
+        if cache is not None:
+            model = cache.get(ckpt.get_hash(), copy=self.mutates_model)
+
+            if model is not None:
+                ckpt.logger.debug("Using cached model for {}"
+                                  .format(ckpt.name))
+                with profile(self.get_name(), "cache"):
+                    self.set_model(model)
+
+                return
+
+        with ckpt:
+            if ckpt.exists():
+                ckpt.logger.info("Loading checkpoint for {} from {}"
+                                 .format(ckpt.name, ckpt.get_path()))
+
+                with profile(self.get_name(), "load"):
                     self.load_model(ckpt)
+            else:
+                if stream:
+                    with profile(self.get_name(), "fit"):
+                        self.fit_chunks(get_data(), **fit_params)
                 else:
-                    self.fit(X, y)
-                    ckpt.logger.info("Saving checkpoint for {} to {}"
-                                     .format(ckpt.name, ckpt.get_path()))
-                    self.save_model(ckpt)
+                    X, y = get_data()
+
+                    with profile(self.get_name(), "fit"):
+                        self.fit(X, y)
+
+                ckpt.logger.info("Saving checkpoint for {} to {}"
+                                 .format(ckpt.name, ckpt.get_path()))
+
+                writer = get_writer()
+
+                if writer is None or not self._save_later(writer, ckpt):
+                    self._save_model(ckpt)
+
+        if cache is not None:
+            cache.put(ckpt.get_hash(), self.get_model())
+
+    def _save_model(self, ckpt):
+        with profile(self.get_name(), "save"):
+            self.save_model(ckpt)
+
+    def _save_later(self, writer, ckpt):
+        """Save a snapshot of the model on the writer's threads.
+
+        The snapshot is taken here, so refitting the pipe before the
+        save runs doesn't change what is saved. Only models that can be
+        pickled are saved in the background.
+        """
+        try:
+            snapshot = Snapshot(self.get_model())
+        except Exception:
+            return False
+
+        pipe = copy.copy(self)
+
+        def save(ckpt):
+            pipe.set_model(snapshot.restore())
+            pipe._save_model(ckpt)
+
+        writer.submit(ckpt, save)
+
+        return True
+
+    def _fit(self, X, y, use_checkpoints, ckpt=None):
+        if use_checkpoints:
+            if ckpt is None:
+                with profile(self.get_name(), "hash"):
+                    data_hash = fingerprint((X, y))
+
+                ckpt = self.get_checkpoint(data_hash)
+
+            self._fit_checkpoint(ckpt, lambda: (X, y))
+
+            return ckpt
         else:
-            self.fit(X, y)
+            with profile(self.get_name(), "fit"):
+                self.fit(X, y)
 
 class Predictor(Pipe):
     @abstractmethod
@@ -58,6 +162,49 @@ class Predictor(Pipe):
         pass
 
 class Transformer(Pipe):
+    # Whether Pipeline.fit should checkpoint the transformed data next
+    # to the model. Worth it when transform is expensive compared to
+    # reading its output back from disk.
+    cache_values = False
+
     @abstractmethod
     def transform(self, X, y=None):
         pass
+
+    def _values_filename(self):
+        return "{}.values".format(self.get_name())
+
+    def has_values(self, ckpt):
+        filename = self._values_filename()
+
+        return (ckpt.has_array("{}.X".format(filename))
+                or ckpt.has_file(filename))
+
+    def save_values(self, ckpt, X, y):
+        filename = self._values_filename()
+
+        # Arrays are stored natively, so they can be memory-mapped on
+        # load, anything else is pickled.
+        if is_array(X) and (y is None or is_array(y)):
+            ckpt.save_array("{}.X".format(filename), X)
+
+            if y is not None:
+                ckpt.save_array("{}.y".format(filename), y)
+        else:
+            with ckpt.open_file(filename, "wb", compression=None) as fd:
+                pickle.dump((X, y), fd, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load_values(self, ckpt):
+        filename = self._values_filename()
+
+        if ckpt.has_array("{}.X".format(filename)):
+            X = ckpt.load_array("{}.X".format(filename))
+            y = None
+
+            if ckpt.has_array("{}.y".format(filename)):
+                y = ckpt.load_array("{}.y".format(filename))
+
+            return X, y
+
+        with ckpt.open_file(filename, "rb", compression=None) as fd:
+            return pickle.load(fd)
@@ -0,0 +1,133 @@
+import os
+import os.path
+import stat
+import logging
+
+from .misc import get_ckpt_path, get_file_hash, mkdirp
+from .manifest import MANIFEST_FILENAME
+
+logger = logging.getLogger("ckpt.blobs")
+
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+def get_blobs_path():
+    return os.path.join(get_ckpt_path(), "blobs")
+
+def get_blob_path(digest):
+    return os.path.join(get_blobs_path(), digest[:2], digest[2:])
+
+def walk_files(path, data_only=False):
+    """Files under `path`. With `data_only`, manifests are skipped, as
+    they are not counted in checkpoint sizes."""
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            if data_only and filename == MANIFEST_FILENAME:
+                continue
+
+            yield os.path.join(root, filename)
+
+def _link(src, dst):
+    tmp = "{}.link".format(dst)
+    os.link(src, tmp)
+    os.replace(tmp, dst)
+
+def link_blobs(path):
+    """Store the files in `path` once, by content.
+
+    Every file is hardlinked with the blob holding its content, so
+    identical files in different checkpoints share their data on disk.
+    Blobs are read-only, as a write through any of the links would
+    change all of them. Where hardlinks are not supported, files are
+    left as they are.
+
+    Returns a dict mapping file paths relative to `path` to their size
+    and content hash.
+    """
+    files = {}
+    linked = True
+
+    for filename in walk_files(path):
+        digest = get_file_hash(filename)
+        files[os.path.relpath(filename, path)] = {
+            "size": os.stat(filename).st_size,
+            "sha256": digest}
+
+        if not linked:
+            continue
+
+        blob = get_blob_path(digest)
+
+        try:
+            try:
+                _link(blob, filename)
+            except FileNotFoundError:
+                mkdirp(os.path.dirname(blob))
+
+                try:
+                    os.link(filename, blob)
+                    os.chmod(blob, READ_ONLY)
+                except FileExistsError:
+                    # Stored by someone else in the meantime
+                    _link(blob, filename)
+        except OSError as err:
+            logger.debug("Not linking blobs in {}: {}".format(path, err))
+            linked = False
+
+    return files
+
+def sweep_blobs(dry_run=False):
+    """Remove blobs no checkpoint links to anymore.
+
+    Returns the number of blobs and bytes removed.
+    """
+    count = size = 0
+
+    for blob in walk_files(get_blobs_path()):
+        st = os.stat(blob)
+
+        if st.st_nlink > 1:
+            continue
+
+        if not dry_run:
+            os.remove(blob)
+
+        count += 1
+        size += st.st_size
+
+    return count, size
+
+def disk_usage():
+    """Logical and physical size of the checkpoints.
+
+    Logical bytes count every checkpoint file in full, physical bytes
+    count data shared through blobs once.
+    """
+    usage = {"logical": 0, "physical": 0, "files": 0, "blobs": 0,
+             "unreferenced": 0, "unreferenced_size": 0}
+    inodes = set()
+
+    for filename in walk_files(os.path.join(get_ckpt_path(), "checkpoints"),
+                               data_only=True):
+        st = os.stat(filename)
+
+        usage['logical'] += st.st_size
+        usage['files'] += 1
+
+        if st.st_ino not in inodes:
+            inodes.add(st.st_ino)
+            usage['physical'] += st.st_size
+
+    for blob in walk_files(get_blobs_path()):
+        st = os.stat(blob)
+
+        usage['blobs'] += 1
+
+        if st.st_nlink == 1:
+            usage['unreferenced'] += 1
+            usage['unreferenced_size'] += st.st_size
+
+        if st.st_ino not in inodes:
+            inodes.add(st.st_ino)
+            usage['physical'] += st.st_size
+
+    return usage
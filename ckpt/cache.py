@@ -0,0 +1,115 @@
+import pickle
+import logging
+import threading
+
+from collections import OrderedDict
+
+from .misc import parse_size
+
+class Snapshot(object):
+    """A model pickled with protocol 5, its large buffers such as numpy
+    arrays kept out-of-band.
+
+    Taken when the model is cached, so later changes to the live model,
+    e.g. refitting the pipe, don't change the cached one.
+    """
+
+    def __init__(self, model):
+        buffers = []
+
+        self.payload = pickle.dumps(model, protocol=5,
+                                    buffer_callback=buffers.append)
+        self.buffers = [buf.raw().tobytes() for buf in buffers]
+        self.size = len(self.payload) + sum(len(buf) for buf in self.buffers)
+
+    def restore(self, copy=False):
+        """Unpickle a new model. Its arrays share their memory with the
+        snapshot, read-only, unless `copy`."""
+        if copy:
+            buffers = [bytearray(buf) for buf in self.buffers]
+        else:
+            buffers = self.buffers
+
+        return pickle.loads(self.payload, buffers=buffers)
+
+class ModelCache(object):
+    """In-memory LRU cache of snapshots of models, keyed by checkpoint
+    hash."""
+
+    def __init__(self, max_size, copy=False):
+        self.max_size = parse_size(max_size)
+        self.copy = copy
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("ckpt.cache")
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, copy=False):
+        with self.lock:
+            if key not in self.entries:
+                return None
+
+            self.entries.move_to_end(key)
+            snapshot = self.entries[key]
+
+        return snapshot.restore(copy or self.copy)
+
+    def put(self, key, model):
+        try:
+            snapshot = Snapshot(model)
+        except Exception:
+            # Not picklable, so it can't be snapshotted
+            return False
+
+        if snapshot.size > self.max_size:
+            return False
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key).size
+
+            self.entries[key] = snapshot
+            self.size += snapshot.size
+
+            while self.size > self.max_size:
+                evicted, evicted_snapshot = self.entries.popitem(last=False)
+                self.size -= evicted_snapshot.size
+                self.logger.debug("Evicted {} from model cache"
+                                  .format(evicted))
+
+        return True
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+model_cache = None
+
+def enable_model_cache(max_size="1G", copy=False):
+    """Keep models loaded or fitted in this process in memory, so
+    pipes hitting the same checkpoint again don't reload it from disk.
+
+    Models are cached as snapshots, and every hit unpickles a new model
+    from one. Its arrays are read-only views of the snapshot, unless
+    `copy` is given, for pipes that change their model in place.
+    """
+    global model_cache
+
+    model_cache = ModelCache(max_size, copy)
+
+    return model_cache
+
+def disable_model_cache():
+    global model_cache
+
+    model_cache = None
+
+def get_model_cache():
+    return model_cache
@@ -1,46 +1,269 @@
 import os
 import os.path
+import sys
 import time
 import logging
-import gzip
+import shutil
+import sqlite3
 import hashlib
+import tempfile
+import copy
 
 from functools import wraps
+from contextlib import contextmanager
 
-from .misc import mkdirp, get_ckpt_path
+from .misc import mkdirp, get_ckpt_path, save_as_json, load_json
+from .codecs import get_codec, detect_codec
+from .lock import FileLock
+from .writer import wait_for
+from .profile import profile
+from .store import get_store
+from .blobs import link_blobs
+from .storage import get_local_cache
+from .manifest import (load_manifest, save_manifest, write_manifest,
+                       cache_manifest, MANIFEST_FILENAME)
+
+SPARSE_COMPONENTS = {"csr": ("data", "indices", "indptr"),
+                     "csc": ("data", "indices", "indptr"),
+                     "coo": ("data", "row", "col")}
+
+def reads_published(fn):
+    """Read again, from a fresh local copy, if the copy in the local
+    cache is evicted halfway through a read."""
+    @wraps(fn)
+    def wrapper(ckpt, *args, **kwargs):
+        try:
+            return fn(ckpt, *args, **kwargs)
+        except FileNotFoundError:
+            if ckpt.read_path in (None, ckpt.get_path()):
+                raise
+
+            ckpt.read_path = None
+
+            return fn(ckpt, *args, **kwargs)
+
+    return wrapper
 
 class Checkpoint(object):
     path = None
+    read_path = None
 
-    def __init__(self, name, dependencies, quiet=False):
+    # Seconds before the lock of a producer that stopped updating it is
+    # considered stale.
+    lock_timeout = 60
+
+    def __init__(self, name, dependencies, quiet=False, parent=None,
+                 codec=None):
         self.name = name
         self.dependencies = dependencies
+        self.parent = parent
+        self.codec = get_codec(codec)
         self.logger = logging.getLogger("ckpt.checkpoint")
         self.quiet = quiet
+        self.entered = False
+        self.staging = None
+        self.lock = None
 
     def __enter__(self):
         if not self.quiet:
             self.logger.info("Entering checkpoint '{}'".format(self.name))
 
-            if self.exists():
+        # A save in the background holds the lock until it publishes
+        wait_for(self.get_hash())
+
+        # Published checkpoints are never modified, so only a producer
+        # needs the lock. Others computing the same checkpoint wait for
+        # it, and then find it published.
+        exists = self.exists()
+
+        if not exists:
+            mkdirp(self.get_store_path())
+
+            self.lock = FileLock(self.get_path() + ".lock",
+                                 stale=self.lock_timeout)
+            self.lock.acquire()
+
+            exists = self._exists()
+
+            if exists:
+                self.release()
+
+        if exists:
+            if not self.quiet:
                 self.logger.info("Found checkpoint for {}".format(self.name))
 
-        self.mkdir()
+            self.account("record_hit", self.get_hash())
+
+        self.started = time.time()
+        self.entered = True
 
         return self
 
-    def __exit__(self, *exc_details):
+    def __exit__(self, exc_type, *exc_details):
         if not self.quiet:
             self.logger.info("Leaving checkpoint '{}'".format(self.name))
 
-        if os.path.exists(self.get_path()) and not self.listdir():
-            if not self.quiet:
-                self.logger.info("Checkpoint dir for {} empty, removing."
-                                 .format(self.name))
-            try:
-                os.rmdir(self.get_path())
-            except NotADirectoryError:
-                pass
+        self.entered = False
+
+        try:
+            if self.staging:
+                if exc_type is None:
+                    self.publish()
+                else:
+                    shutil.rmtree(self.staging, ignore_errors=True)
+        finally:
+            self.staging = None
+            self.release()
+
+    def detach(self):
+        """Hand the staging directory and lock over to a copy of the
+        checkpoint, which publishes them when it exits. Leaving the
+        with-block of this checkpoint no longer publishes anything."""
+        detached = copy.copy(self)
+
+        self.staging = None
+        self.lock = None
+
+        return detached
+
+    def account(self, method, *args):
+        # Accounting is best effort, it should never fail a checkpoint
+        try:
+            getattr(get_store(), method)(*args)
+        except sqlite3.Error as err:
+            self.logger.warning("Checkpoint accounting failed: {}"
+                                .format(err))
+
+    def release(self):
+        if self.lock:
+            self.lock.release()
+            self.lock = None
+
+    def publish(self):
+        """Move files written in the staging directory into place.
+
+        A new checkpoint is published by renaming its staging directory,
+        so other processes see either nothing or the complete
+        checkpoint. Files added to an already published checkpoint are
+        moved in one by one.
+
+        Files are linked with content-addressed blobs first, see
+        `ckpt.blobs`, and listed in the checkpoint's manifest.
+        """
+        with profile(self.name, "publish"):
+            self._publish()
+
+    def _publish(self):
+        if not os.listdir(self.staging):
+            os.rmdir(self.staging)
+            return
+
+        local = None
+
+        if os.path.dirname(self.staging) != self.get_store_path():
+            # Staged in the local cache, copied to the store to publish
+            local = self.staging
+            self.staging = tempfile.mkdtemp(prefix=".{}.".format(
+                                                self.get_hash()),
+                                            dir=self.get_store_path())
+            shutil.copytree(local, self.staging, dirs_exist_ok=True)
+
+        files = link_blobs(self.staging)
+        size = sum(item['size'] for item in files.values())
+        cost = time.time() - self.started
+        manifest = {"name": self.name,
+                    "hash": self.get_hash(),
+                    "lineage": [list(item) for item in self.get_lineage()],
+                    "codec": self.codec.name,
+                    "created": time.time(),
+                    "files": files}
+
+        # Written before the rename, so a published checkpoint always
+        # has its manifest
+        write_manifest(self.staging, manifest)
+
+        try:
+            os.rename(self.staging, self.get_path())
+            cache_manifest(self.get_path(), manifest)
+
+            if local:
+                get_local_cache().add(self.get_hash(), local, manifest)
+        except OSError:
+            if not os.path.isdir(self.get_path()):
+                raise
+
+            os.remove(os.path.join(self.staging, MANIFEST_FILENAME))
+
+            with self._publish_lock():
+                for filename in os.listdir(self.staging):
+                    path = os.path.join(self.get_path(), filename)
+
+                    if os.path.exists(path):
+                        size -= os.stat(path).st_size
+
+                    os.replace(os.path.join(self.staging, filename), path)
+
+                published = load_manifest(self.get_path(), refresh=True)
+
+                # Checkpoints published before manifests were written
+                # are left without one, as it would not list their
+                # files.
+                if published is not None:
+                    published['files'].update(files)
+                    save_manifest(self.get_path(), published)
+
+            os.rmdir(self.staging)
+
+            # The cached copy is out of date now, and fetched again
+            # when it is read
+            if local:
+                shutil.rmtree(local, ignore_errors=True)
+                get_local_cache().remove(self.get_hash())
+
+        self.read_path = None
+        self.account("record_save", self.get_hash(), self.name, size, cost)
+
+    @contextmanager
+    def _publish_lock(self):
+        # Held already when adding files with `extend`
+        if self.lock:
+            yield
+            return
+
+        with FileLock(self.get_path() + ".lock", stale=self.lock_timeout):
+            yield
+
+    @contextmanager
+    def extend(self):
+        """Add files to the published checkpoint, like a with-block.
+
+        Yields whether the checkpoint is published. Nothing is added if
+        it isn't, as a checkpoint is never published with only some of
+        its files. The checkpoint's lock is held until the files are
+        published, so it isn't evicted meanwhile.
+        """
+        wait_for(self.get_hash())
+        mkdirp(self.get_store_path())
+
+        lock = FileLock(self.get_path() + ".lock", stale=self.lock_timeout)
+        lock.acquire()
+
+        if not self._exists():
+            lock.release()
+            yield False
+            return
+
+        self.lock = lock
+        self.started = time.time()
+        self.entered = True
+
+        try:
+            yield True
+        except BaseException:
+            self.__exit__(*sys.exc_info())
+            raise
+
+        self.__exit__(None, None, None)
 
     @staticmethod
     def save(fn):
@@ -70,40 +293,270 @@ class Checkpoint(object):
         for dep in sorted(self.dependencies):
             m.update(dep.encode("utf-8"))
 
+        # Chain the key to the upstream checkpoint, so a downstream
+        # checkpoint is identified without hashing its input data.
+        if self.parent:
+            m.update(self.parent.get_hash().encode("utf-8"))
+
         return m.hexdigest()
 
+    def get_lineage(self):
+        lineage = []
+        ckpt = self
+
+        while ckpt:
+            lineage.append((ckpt.name, ckpt.get_hash()))
+            ckpt = ckpt.parent
+
+        return lineage[::-1]
+
+    def get_store_path(self):
+        return os.path.join(get_ckpt_path(), "checkpoints")
+
     def get_path(self):
         if not self.path:
-            self.path = os.path.join(get_ckpt_path(), "checkpoints",
-                                     self.get_hash())
+            self.path = os.path.join(self.get_store_path(), self.get_hash())
 
         return self.path
 
-    def join_path(self, *paths):
+    def get_staging_path(self):
+        """Directory new files are written to until the checkpoint is
+        published on exit. On local disk, if a local cache is
+        enabled."""
+        if not self.staging:
+            cache = get_local_cache()
+
+            if cache:
+                self.staging = cache.get_staging_path(self.get_hash())
+            else:
+                mkdirp(self.get_store_path())
+                self.staging = tempfile.mkdtemp(prefix=".{}.".format(
+                                                    self.get_hash()),
+                                                dir=self.get_store_path())
+
+        return self.staging
+
+    def get_read_path(self):
+        """Directory published files are read from, the copy in the
+        local cache if one is enabled. See `ckpt.storage`."""
+        # Evicted from the cache since
+        if self.read_path is not None and not os.path.isdir(self.read_path):
+            self.read_path = None
+
+        if self.read_path is None:
+            cache = get_local_cache()
+            manifest = self.get_manifest()
+
+            # Checkpoints without a manifest can't be validated, and
+            # are read from the store
+            if not cache or manifest is None:
+                return self.get_path()
+
+            self.read_path = cache.get(self.get_hash(), self.get_path(),
+                                       manifest) or self.get_path()
+
+        return self.read_path
+
+    def get_manifest(self):
+        return load_manifest(self.get_path())
+
+    def is_published(self, *paths):
+        """Whether a file or directory is in the published checkpoint.
+
+        Looked up in the manifest, where the checkpoint has one, rather
+        than on disk.
+        """
+        manifest = self.get_manifest()
+
+        if manifest is None:
+            return os.path.exists(os.path.join(self.get_path(), *paths))
+
+        path = os.path.normpath(os.path.join(*paths))
+
+        return path in manifest['files'] or any(
+            filename.startswith(path + os.sep)
+            for filename in manifest['files'])
+
+    def find_path(self, *paths):
+        """Path to read a file from, published or staged."""
+        if self.is_published(*paths):
+            return os.path.join(self.get_read_path(), *paths)
+
+        if self.staging and os.path.exists(os.path.join(self.staging,
+                                                        *paths)):
+            return os.path.join(self.staging, *paths)
+
         return os.path.join(self.get_path(), *paths)
 
+    def join_path(self, *paths):
+        """Path to read or write a file at.
+
+        Inside a with-block, this is always in the staging directory,
+        and a published file is copied there first, so writing to it
+        leaves the shared blob alone. Outside, published files can only
+        be read, through `find_path`.
+        """
+        path = self.write_path(*paths)
+
+        if self.entered and not os.path.exists(path) \
+           and self.is_published(*paths):
+            source = self.find_path(*paths)
+            mkdirp(os.path.dirname(path))
+
+            if os.path.isdir(source):
+                shutil.copytree(source, path)
+            else:
+                shutil.copyfile(source, path)
+
+        return path
+
+    def write_path(self, *paths):
+        """Path to write a file to. Inside a with-block, files are
+        always written to the staging directory, as published files may
+        share their data with other checkpoints."""
+        if not self.entered:
+            if self.is_published(*paths):
+                raise ValueError("{} is published in checkpoint {}, it can "
+                                 "only be written inside a with-block"
+                                 .format(os.path.join(*paths), self.name))
+
+            return os.path.join(self.get_path(), *paths)
+
+        return os.path.join(self.get_staging_path(), *paths)
+
+    def has_file(self, *paths):
+        return (self.is_published(*paths)
+                or bool(self.staging
+                        and os.path.exists(os.path.join(self.staging,
+                                                        *paths))))
+
     def mkdir(self):
-        mkdirp(self.get_path())
+        return self.get_staging_path()
 
     def listdir(self):
-        return sorted([self.join_path(path)
-                       for path in os.listdir(self.get_path())])
+        paths = [os.path.join(path, filename)
+                 for path in (self.get_read_path(), self.staging)
+                 if path and os.path.isdir(path)
+                 for filename in os.listdir(path)]
+
+        return sorted(paths)
 
     def exists(self):
-        return os.path.exists(self.get_path()) and len(self.listdir()) > 0
+        # Holding the lock, nothing is published until we publish it
+        if self.lock:
+            return False
+
+        return self._exists()
 
-    def open_file(self, filename, mode="r", compression=gzip):
-        filename = self.join_path(filename)
+    def _exists(self):
+        if self.get_manifest() is not None:
+            return True
 
-        if compression:
-            # Default to text mode if not specified, as is the case
-            # for builtins.open
-            if not any(True for c in mode
-                        if c in ("t", "b")):
-                mode += "t"
+        # Checkpoints published before manifests were written
+        try:
+            return len(os.listdir(self.get_path())) > 0
+        except FileNotFoundError:
+            return False
 
-            filename += ".gz"
+    @reads_published
+    def open_file(self, filename, mode="r", compression=True):
+        """Open a file in the checkpoint.
 
-            return compression.open(filename, mode)
+        Files are written with the checkpoint's codec, or `compression`
+        if given. The codec is recorded in the file suffix, so reading
+        detects it automatically.
+        """
+        # Default to text mode if not specified, as is the case
+        # for builtins.open
+        if not any(True for c in mode
+                   if c in ("t", "b")):
+            mode += "t"
+
+        if compression is True:
+            codec = self.codec
         else:
-            return open(filename, mode)
+            codec = get_codec(compression or "none")
+
+        if "r" in mode:
+            path = self.get_read_path()
+            found, found_path = detect_codec(
+                os.path.join(path, filename), codec,
+                exists=lambda found_path: self.is_published(
+                    os.path.relpath(found_path, path)))
+
+            if not found and self.staging:
+                found, found_path = detect_codec(
+                    os.path.join(self.staging, filename), codec)
+
+            if found:
+                return found.open(found_path, mode)
+
+        return codec.open(self.write_path(filename) + codec.suffix, mode)
+
+    def _array_filename(self, name, component=None, write=False):
+        if component:
+            name = "{}.{}".format(name, component)
+
+        if write:
+            return self.write_path("{}.npy".format(name))
+
+        return self.find_path("{}.npy".format(name))
+
+    def has_array(self, name):
+        return (self.has_file("{}.npy".format(name))
+                or self.has_file("{}.sparse".format(name)))
+
+    def save_array(self, name, arr):
+        import numpy as np
+
+        # Only sparse if scipy is imported already
+        sparse = sys.modules.get("scipy.sparse")
+
+        if sparse and sparse.issparse(arr):
+            if arr.format not in SPARSE_COMPONENTS:
+                arr = arr.tocsr()
+
+            components = SPARSE_COMPONENTS[arr.format]
+
+            for component in components:
+                np.save(self._array_filename(name, component, write=True),
+                        getattr(arr, component), allow_pickle=False)
+
+            save_as_json({"format": arr.format,
+                          "shape": arr.shape},
+                         self.write_path("{}.sparse".format(name)))
+        else:
+            np.save(self._array_filename(name, write=True), arr,
+                    allow_pickle=False)
+
+    @reads_published
+    def load_array(self, name, mmap_mode="r"):
+        """Load an array saved with `save_array`.
+
+        With `mmap_mode` set, the data is memory-mapped rather than
+        read, so processes loading the same checkpoint share one copy
+        in the page cache.
+        """
+        import numpy as np
+
+        filename = self._array_filename(name)
+
+        if os.path.exists(filename):
+            return np.load(filename, mmap_mode=mmap_mode, allow_pickle=False)
+
+        import scipy.sparse
+
+        header = load_json(self.find_path("{}.sparse".format(name)))
+        fmt = header['format']
+        components = [np.load(self._array_filename(name, component),
+                              mmap_mode=mmap_mode, allow_pickle=False)
+                      for component in SPARSE_COMPONENTS[fmt]]
+
+        if fmt == "coo":
+            data, row, col = components
+            return scipy.sparse.coo_matrix((data, (row, col)),
+                                           shape=header['shape'])
+
+        cls = getattr(scipy.sparse, "{}_matrix".format(fmt))
+
+        return cls(tuple(components), shape=header['shape'], copy=False)
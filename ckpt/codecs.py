@@ -0,0 +1,130 @@
+import os
+import gzip
+import lzma
+import bz2
+
+class Codec(object):
+    def __init__(self, name, suffix, opener, level=None, threads=None):
+        self.name = name
+        self.suffix = suffix
+        self.opener = opener
+        self.level = level
+        self.threads = threads
+
+    def __repr__(self):
+        return "Codec({!r}, level={!r}, threads={!r})".format(self.name,
+                                                             self.level,
+                                                             self.threads)
+
+    def with_options(self, level=None, threads=None):
+        return Codec(self.name, self.suffix, self.opener,
+                     self.level if level is None else level,
+                     self.threads if threads is None else threads)
+
+    def open(self, filename, mode="r"):
+        writing = any(c in mode for c in "wax")
+
+        return self.opener(filename, mode,
+                           self.level if writing else None,
+                           self.threads)
+
+def _open_none(filename, mode, level, threads):
+    return open(filename, mode)
+
+def _open_gzip(filename, mode, level, threads):
+    return gzip.open(filename, mode, compresslevel=9 if level is None else level)
+
+def _open_bz2(filename, mode, level, threads):
+    return bz2.open(filename, mode, compresslevel=9 if level is None else level)
+
+def _open_lzma(filename, mode, level, threads):
+    return lzma.open(filename, mode, preset=level)
+
+codecs = {}
+
+def add_codec(codec):
+    codecs[codec.name] = codec
+
+def get_codecs():
+    return codecs
+
+default_codec = "gzip"
+
+def set_default_codec(name):
+    global default_codec
+
+    get_codec(name)
+    default_codec = name
+
+def get_codec(codec=None, level=None, threads=None):
+    """Look up a codec by name.
+
+    `codec` can also be a `Codec` or a compression module named after a
+    registered codec (e.g. `gzip`). Defaults to `default_codec`.
+    """
+
+    if codec is None:
+        codec = default_codec
+    elif hasattr(codec, "__name__"):
+        codec = codec.__name__
+
+    if not isinstance(codec, Codec):
+        if codec not in codecs:
+            raise ValueError("Unknown codec '{}', available: {}"
+                             .format(codec, ", ".join(sorted(codecs))))
+
+        codec = codecs[codec]
+
+    return codec.with_options(level, threads)
+
+def detect_codec(filename, preferred=None, exists=os.path.exists):
+    """Find the codec a file was written with from its suffix.
+
+    Returns the codec and the full filename, or `(None, None)` if no
+    file exists for any of the registered codecs. `exists` checks
+    whether a candidate filename exists.
+    """
+
+    candidates = list(codecs.values())
+
+    if preferred:
+        candidates.insert(0, preferred)
+
+    for codec in candidates:
+        path = filename + codec.suffix
+
+        if exists(path):
+            return codec, path
+
+    return None, None
+
+add_codec(Codec("none", "", _open_none))
+add_codec(Codec("gzip", ".gz", _open_gzip))
+add_codec(Codec("bz2", ".bz2", _open_bz2))
+add_codec(Codec("lzma", ".xz", _open_lzma))
+
+try:
+    import zstandard
+
+    def _open_zstd(filename, mode, level, threads):
+        if level is None and threads is None:
+            return zstandard.open(filename, mode)
+
+        cctx = zstandard.ZstdCompressor(level=3 if level is None else level,
+                                        threads=threads or 0)
+
+        return zstandard.open(filename, mode, cctx=cctx)
+
+    add_codec(Codec("zstd", ".zst", _open_zstd))
+except ImportError:
+    pass
+
+try:
+    import lz4.frame
+
+    def _open_lz4(filename, mode, level, threads):
+        return lz4.frame.open(filename, mode, compression_level=level or 0)
+
+    add_codec(Codec("lz4", ".lz4", _open_lz4))
+except ImportError:
+    pass
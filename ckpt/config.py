@@ -2,7 +2,24 @@ import os.path
 
 from .misc import load_json, get_ckpt_path
 
-try:
-    ckpt_config = load_json(os.path.join(get_ckpt_path(), "config"))
-except FileNotFoundError:
-    ckpt_config = {}
+configs = {}
+
+def get_config():
+    """The config file of the current ckpt path, read on first use."""
+    path = get_ckpt_path()
+
+    if path not in configs:
+        try:
+            configs[path] = load_json(os.path.join(path, "config"))
+        except FileNotFoundError:
+            configs[path] = {}
+
+    return configs[path]
+
+def __getattr__(name):
+    # `ckpt_config` used to be read at import time
+    if name == "ckpt_config":
+        return get_config()
+
+    raise AttributeError("module {!r} has no attribute {!r}"
+                         .format(__name__, name))
@@ -1,19 +1,26 @@
 import os.path
 import time
+import json
 import logging
 import hashlib
-import pickle
 
 from .misc import mkdirp, get_ckpt_path, save_as_json, get_short_hashes
 from .checkpoint import Checkpoint
+from .index import ExperimentIndex
+from .results import save_experiment, encode_value
+from .writer import flush_writes
+from .profile import start_profiling, stop_profiling
+from .fingerprint import fingerprint
 
 LOG_FORMAT = '%(asctime)s %(name)-10s %(message)s'
 LOG_DATEFMT = '%H:%M'
 LOG_LEVEL = logging.INFO
 
-logging.basicConfig(format=LOG_FORMAT,
-                    datefmt=LOG_DATEFMT,
-                    level=LOG_LEVEL)
+def setup_logging():
+    # Does nothing if the application has configured logging already
+    logging.basicConfig(format=LOG_FORMAT,
+                        datefmt=LOG_DATEFMT,
+                        level=LOG_LEVEL)
 
 metrics = {}
 reports = {}
@@ -39,15 +46,24 @@ class Experiment(object):
         self.logger = logging.getLogger("ckpt.experiment")
 
     def __enter__(self):
+        setup_logging()
         self.logger.info("Running experiment '{}'".format(self.name))
         self.results = {}
         self.metadata['start'] = time.time()
 
         mkdirp(self.get_path())
+        start_profiling()
 
         return self
 
     def __exit__(self, *exc_details):
+        # Checkpoints saved in the background are done before the
+        # experiment is
+        try:
+            flush_writes()
+        finally:
+            self.metadata['profile'] = stop_profiling()
+
         self.metadata['stop'] = time.time()
 
         if self.results:
@@ -63,20 +79,15 @@ class Experiment(object):
         self.logger.info("Added results: {}".format(name))
 
     def get_filename(self, data):
-        def update_hash(m, d):
-            for key, value in sorted(d.items()):
-                m.update(key.encode("utf-8"))
-
-                if isinstance(value, dict):
-                    update_hash(m, value)
-                else:
-                    m.update(str(value).encode("utf-8"))
-
+        # The results are fingerprinted from their buffers rather than
+        # formatted as text
         m = hashlib.sha256()
+        m.update(json.dumps(encode_value({"config": data['config'],
+                                          "metadata": data['metadata']}),
+                            sort_keys=True).encode("utf-8"))
+        m.update(fingerprint(data['results']).encode("utf-8"))
 
-        update_hash(m, data)
-
-        return os.path.join(self.get_path(), "{}.pkl".format(m.hexdigest()))
+        return os.path.join(self.get_path(), "{}.json".format(m.hexdigest()))
 
     def get_path(self):
         return os.path.join(get_ckpt_path(), "experiments")
@@ -90,5 +101,7 @@ class Experiment(object):
         ex_id = get_short_hashes([os.path.basename(filename)])[0]
         self.logger.info("Saving experiment {}".format(ex_id))
         if not self.dry_run:
-            with open(self.get_filename(data), "wb") as fd:
-                pickle.dump(data, fd)
+            save_experiment(filename, data)
+
+            with ExperimentIndex() as index:
+                index.add(filename, data, get_metrics())
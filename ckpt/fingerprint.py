@@ -0,0 +1,156 @@
+import sys
+import hashlib
+import pickle
+
+hashers = {"sha256": hashlib.sha256,
+           "blake2b": hashlib.blake2b}
+
+try:
+    import xxhash
+    hashers["xxhash"] = xxhash.xxh3_128
+except ImportError:
+    pass
+
+try:
+    import blake3
+    hashers["blake3"] = blake3.blake3
+except ImportError:
+    pass
+
+default_hasher = "sha256"
+
+CHUNK_SIZE = 2**24
+
+def add_hasher(name, fn):
+    hashers[name] = fn
+
+def get_hashers():
+    return hashers
+
+def set_hasher(name):
+    global default_hasher
+
+    if name not in hashers:
+        raise ValueError("Unknown hasher '{}', available: {}"
+                         .format(name, ", ".join(sorted(hashers))))
+
+    default_hasher = name
+
+def get_hasher(name=None):
+    return hashers[name or default_hasher]()
+
+def _module(name):
+    # Only look at modules that are already imported. If e.g. numpy
+    # has not been imported, the item can not be a numpy array.
+    return sys.modules.get(name)
+
+class Fingerprint(object):
+    """Incremental content hash of (nested) training data.
+
+    Arrays are fed to the hash function straight from their buffers,
+    in chunks of at most `chunk_size` bytes, instead of being pickled
+    into one large bytes object first.
+    """
+
+    def __init__(self, hasher=None, chunk_size=CHUNK_SIZE):
+        self.m = get_hasher(hasher)
+        self.chunk_size = chunk_size
+
+    def hexdigest(self):
+        return self.m.hexdigest()
+
+    def _tag(self, tag, *header):
+        self.m.update(tag.encode("utf-8"))
+        self.m.update(repr(header).encode("utf-8"))
+
+    def _update_buffer(self, buf):
+        for i in range(0, len(buf), self.chunk_size):
+            self.m.update(buf[i:i + self.chunk_size])
+
+    def _update_array(self, arr):
+        np = _module("numpy")
+
+        self._tag("ndarray", arr.dtype.str, arr.shape, arr.strides)
+
+        if arr.dtype.hasobject:
+            self.m.update(pickle.dumps(arr, protocol=pickle.HIGHEST_PROTOCOL))
+        elif arr.flags.c_contiguous or arr.flags.f_contiguous:
+            # Hash in memory order, the strides in the header
+            # determine the layout.
+            flat = arr.ravel(order="K").view(np.uint8)
+            self._update_buffer(memoryview(flat))
+        else:
+            row_size = max(arr[:1].nbytes, 1)
+            step = max(self.chunk_size // row_size, 1)
+
+            for i in range(0, arr.shape[0], step):
+                chunk = np.ascontiguousarray(arr[i:i + step])
+                self._update_buffer(memoryview(chunk.reshape(-1)
+                                               .view(np.uint8)))
+
+    def _update_sparse(self, matrix):
+        self._tag("sparse", matrix.format, matrix.shape)
+
+        if matrix.format in ("csr", "csc", "bsr"):
+            components = (matrix.data, matrix.indices, matrix.indptr)
+        elif matrix.format == "coo":
+            components = (matrix.row, matrix.col, matrix.data)
+        else:
+            components = (matrix.tocsr(),)
+
+        for component in components:
+            self.update(component)
+
+    def _update_frame(self, frame):
+        self._tag("dataframe", frame.shape)
+        self.update(frame.columns)
+        self.update(frame.index)
+
+        for _, column in frame.items():
+            self._update_series(column)
+
+    def _update_series(self, series):
+        self._tag("series", str(series.dtype), series.name)
+        self.update(series.index)
+        self.update(series.to_numpy())
+
+    def update(self, item):
+        np = _module("numpy")
+        sparse = _module("scipy.sparse")
+        pd = _module("pandas")
+
+        if np and isinstance(item, np.ndarray):
+            self._update_array(item)
+        elif sparse and sparse.issparse(item):
+            self._update_sparse(item)
+        elif pd and isinstance(item, pd.DataFrame):
+            self._update_frame(item)
+        elif pd and isinstance(item, pd.Series):
+            self._update_series(item)
+        elif pd and isinstance(item, pd.Index):
+            self._tag("index", type(item).__name__, item.name)
+            self.update(item.to_numpy())
+        elif isinstance(item, (tuple, list)):
+            self._tag(type(item).__name__, len(item))
+
+            for value in item:
+                self.update(value)
+        elif isinstance(item, dict):
+            self._tag("dict", len(item))
+
+            try:
+                items = sorted(item.items())
+            except TypeError:
+                items = item.items()
+
+            for key, value in items:
+                self.update(key)
+                self.update(value)
+        else:
+            self._tag("pickle")
+            self.m.update(pickle.dumps(item))
+
+        return self
+
+def fingerprint(item, hasher=None):
+    return Fingerprint(hasher).update(item).hexdigest()
@@ -0,0 +1,374 @@
+import os
+import os.path
+import time
+import json
+import pickle
+import sqlite3
+import logging
+
+from .misc import (get_ckpt_path, flatten, get_function_hash,
+                   shortest_unique_prefix, common_prefix_length,
+                   AmbiguousIdError)
+from .results import load_experiment, EXTENSIONS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS experiments (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    name TEXT,
+    config BLOB,
+    flat_config TEXT,
+    metadata BLOB,
+    results TEXT
+);
+
+CREATE TABLE IF NOT EXISTS metrics (
+    id TEXT NOT NULL,
+    result TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    fn_hash TEXT,
+    value BLOB,
+    PRIMARY KEY (id, result, metric)
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+SCHEMA_VERSION = 2
+
+def get_experiment_id(filename):
+    return os.path.splitext(os.path.basename(filename))[0]
+
+def compute_metrics(results, metrics, keys=None):
+    scores = {}
+
+    for name, result in results.items():
+        for metric, fn in metrics.items():
+            if keys is None or (name, metric) in keys:
+                scores[(name, metric)] = fn(result['y_true'],
+                                            result['y_pred'])
+
+    return scores
+
+def get_score_names(scores):
+    return {("{}-{}".format(result, metric) if result else metric): value
+            for (result, metric), value in scores.items()}
+
+worker_metrics = None
+
+def _init_worker(metrics):
+    global worker_metrics
+
+    worker_metrics = metrics
+
+def _compute_worker(args):
+    filename, keys = args
+
+    return compute_metrics(load_experiment(filename)['results'],
+                           worker_metrics, keys)
+
+def compute_metrics_parallel(jobs, metrics, jobs_args):
+    """Compute metrics for `(filename, keys)` pairs on a process pool.
+
+    Results are returned in the order of `jobs_args`. Metrics are
+    handed to the workers when they start, which on platforms that
+    fork also covers functions that can't be pickled, such as lambdas
+    registered in the user's script.
+    """
+    import multiprocessing
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context,
+                             initializer=_init_worker,
+                             initargs=(metrics,)) as executor:
+        return list(executor.map(_compute_worker, jobs_args))
+
+class ExperimentIndex(object):
+    """SQLite index over the experiments in the ckpt path.
+
+    Holds everything `ckpt report` needs (name, config, metadata and
+    computed metrics), so reports don't have to unpickle the result
+    files. Kept up to date by `Experiment.save`, and synced with the
+    experiments directory whenever its mtime changes.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_ckpt_path()
+        self.logger = logging.getLogger("ckpt.index")
+        self.db = sqlite3.connect(os.path.join(self.path, "index.sqlite"),
+                                  timeout=60)
+        self.fn_hashes = {}
+
+        version, = self.db.execute("PRAGMA user_version").fetchone()
+
+        if version != SCHEMA_VERSION:
+            # The index only caches what is in the experiment files, so
+            # on a schema change it is simply rebuilt.
+            self.db.executescript("DROP TABLE IF EXISTS experiments;"
+                                  "DROP TABLE IF EXISTS metrics;"
+                                  "DROP TABLE IF EXISTS meta;")
+            self.db.executescript(SCHEMA)
+            self.db.execute("PRAGMA user_version = {}"
+                            .format(SCHEMA_VERSION))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_details):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def get_experiments_path(self):
+        return os.path.join(self.path, "experiments")
+
+    def _get_meta(self, key):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?",
+                              (key,)).fetchone()
+
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                        (key, value))
+
+    def add(self, filename, data, metrics=None):
+        ex_id = get_experiment_id(filename)
+        config = data.get('config', {})
+        metadata = data.get('metadata', {})
+        results = data.get('results', {})
+
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO experiments "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (ex_id, os.path.basename(filename),
+                             metadata.get('name'),
+                             pickle.dumps(config),
+                             json.dumps(flatten(config), default=str),
+                             pickle.dumps(metadata),
+                             json.dumps(sorted(results))))
+            self.db.execute("DELETE FROM metrics WHERE id = ?", (ex_id,))
+
+            # Old style experiments only have metrics computed at
+            # experiment time.
+            self.add_scores(ex_id, {("", name): value for name, value
+                                    in data.get('metrics', {}).items()})
+
+            if metrics:
+                self.add_scores(ex_id, compute_metrics(results, metrics),
+                                metrics)
+
+            prefix_length = self._get_meta("prefix_length")
+
+            if prefix_length is not None:
+                self._set_meta("prefix_length",
+                               max(int(prefix_length),
+                                   self.get_unique_prefix_length(ex_id)))
+
+        return ex_id
+
+    def get_function_hash(self, fn):
+        if fn not in self.fn_hashes:
+            self.fn_hashes[fn] = get_function_hash(fn)
+
+        return self.fn_hashes[fn]
+
+    def add_scores(self, ex_id, scores, metrics=None):
+        self.db.executemany("INSERT OR REPLACE INTO metrics "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            ((ex_id, result, metric,
+                              (self.get_function_hash(metrics[metric])
+                               if metrics else None),
+                              pickle.dumps(value))
+                             for (result, metric), value in scores.items()))
+
+    def get_scores(self, ex_id, metrics=None, results=None):
+        """Cached scores for an experiment.
+
+        Includes metrics saved with old style experiments, and the
+        given registered `metrics` for each of the experiment's
+        `results`. Returns the scores along with the (result, metric)
+        pairs that are missing, or whose metric function has changed
+        since they were computed.
+        """
+        metrics = metrics or {}
+        stored = {}
+
+        for result, metric, fn_hash, value in self.db.execute(
+                "SELECT result, metric, fn_hash, value FROM metrics "
+                "WHERE id = ?", (ex_id,)):
+            stored[(result, metric)] = (fn_hash, value)
+
+        if results is None:
+            results = self.get(ex_id)['results']
+
+        stale = set((result, metric) for result in results
+                    for metric, fn in metrics.items()
+                    if stored.get((result, metric), (None,))[0]
+                    != self.get_function_hash(fn))
+
+        scores = {key: pickle.loads(value)
+                  for key, (fn_hash, value) in stored.items()
+                  if fn_hash is None or key[1] in metrics}
+
+        return scores, stale
+
+    def get_metrics(self, ex_id, metrics=None, results=None):
+        """Scores for an experiment, computing and caching the stale
+        ones from the result file."""
+        scores, stale = self.get_scores(ex_id, metrics, results)
+
+        if stale:
+            computed = compute_metrics(self.load(ex_id)['results'], metrics,
+                                       stale)
+
+            with self.db:
+                self.add_scores(ex_id, computed, metrics)
+
+            scores.update(computed)
+
+        return get_score_names(scores)
+
+    def remove(self, ex_id):
+        with self.db:
+            self.db.execute("DELETE FROM experiments WHERE id = ?", (ex_id,))
+            self.db.execute("DELETE FROM metrics WHERE id = ?", (ex_id,))
+            # Recomputed on demand, as removing an id can shorten it
+            self.db.execute("DELETE FROM meta WHERE key = 'prefix_length'")
+
+    def _load_file(self, filename):
+        return load_experiment(os.path.join(self.get_experiments_path(),
+                                                 filename))
+
+    def sync(self, metrics=None, force=False):
+        """Add experiment files missing from the index and drop entries
+        whose file is gone."""
+        path = self.get_experiments_path()
+
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+
+        mtime = str(stat.st_mtime_ns)
+
+        # On filesystems with coarse timestamps, a file added right
+        # after the last sync may not have changed the mtime.
+        settled = time.time() - stat.st_mtime > 2
+
+        if not force and settled and mtime == self._get_meta("mtime"):
+            return
+
+        filenames = {get_experiment_id(filename): filename
+                     for filename in os.listdir(path)
+                     if filename.endswith(EXTENSIONS)}
+        indexed = set(self.get_ids())
+
+        for ex_id in indexed - set(filenames):
+            self.remove(ex_id)
+
+        for ex_id in sorted(set(filenames) - indexed):
+            self.logger.info("Indexing experiment {}".format(ex_id))
+            self.add(filenames[ex_id], self._load_file(filenames[ex_id]),
+                     metrics)
+
+        with self.db:
+            self._set_meta("mtime", mtime)
+
+    def rebuild(self, metrics=None):
+        with self.db:
+            self.db.execute("DELETE FROM experiments")
+            self.db.execute("DELETE FROM metrics")
+            self.db.execute("DELETE FROM meta")
+
+        self.sync(metrics, force=True)
+
+    def get_ids(self):
+        return [row[0] for row in
+                self.db.execute("SELECT id FROM experiments ORDER BY id")]
+
+    def _get_range(self, prefix, limit):
+        # All ids starting with `prefix` sort between `prefix` and the
+        # prefix with its last character incremented.
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+        return [row[0] for row in
+                self.db.execute("SELECT id FROM experiments "
+                                "WHERE id >= ? AND id < ? "
+                                "ORDER BY id LIMIT ?",
+                                (prefix, upper, limit))]
+
+    def resolve(self, prefix):
+        """Full id of the experiment whose id starts with `prefix`.
+
+        Returns None if there is no such experiment, and raises
+        `AmbiguousIdError` if there is more than one.
+        """
+        if not prefix:
+            raise AmbiguousIdError("Empty experiment id")
+
+        ex_ids = self._get_range(prefix, 2)
+
+        if len(ex_ids) > 1:
+            raise AmbiguousIdError("Experiment id '{}' is ambiguous, "
+                                   "matches {} and {}"
+                                   .format(prefix, *ex_ids))
+
+        return ex_ids[0] if ex_ids else None
+
+    def get_unique_prefix_length(self, ex_id):
+        neighbours = self.db.execute(
+            "SELECT * FROM "
+            "(SELECT id FROM experiments WHERE id < ? "
+            " ORDER BY id DESC LIMIT 1) "
+            "UNION ALL SELECT * FROM "
+            "(SELECT id FROM experiments WHERE id > ? "
+            " ORDER BY id LIMIT 1)", (ex_id, ex_id))
+
+        return 1 + max((common_prefix_length(ex_id, row[0])
+                        for row in neighbours), default=0)
+
+    def get_prefix_length(self):
+        """Shortest prefix length that is unique for all ids."""
+        prefix_length = self._get_meta("prefix_length")
+
+        if prefix_length is None:
+            prefix_length = shortest_unique_prefix(self.get_ids())
+
+            with self.db:
+                self._set_meta("prefix_length", prefix_length)
+
+        return int(prefix_length)
+
+    def get_filename(self, ex_id):
+        row = self.db.execute("SELECT filename FROM experiments WHERE id = ?",
+                              (ex_id,)).fetchone()
+
+        return os.path.join(self.get_experiments_path(), row[0])
+
+    def get(self, ex_id):
+        row = self.db.execute("SELECT config, metadata, results "
+                              "FROM experiments WHERE id = ?",
+                              (ex_id,)).fetchone()
+
+        if row is None:
+            raise KeyError(ex_id)
+
+        config, metadata, results = row
+
+        return {"config": pickle.loads(config),
+                "metadata": pickle.loads(metadata),
+                "results": json.loads(results)}
+
+    def load(self, ex_id):
+        return self._load_file(os.path.basename(self.get_filename(ex_id)))
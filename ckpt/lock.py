@@ -0,0 +1,168 @@
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+
+class LockTimeout(Exception):
+    pass
+
+class FileLock(object):
+    """Advisory lock on a path, held by creating `path` exclusively.
+
+    Works across processes and hosts sharing a filesystem. While the
+    lock is held, a background thread touches the lock file every
+    `stale / 4` seconds, so a lock whose file has not been touched for
+    `stale` seconds belongs to a crashed process and is broken. On the
+    same host, a lock held by a process that no longer exists is
+    broken right away.
+    """
+
+    def __init__(self, path, timeout=None, stale=60, poll=0.1):
+        self.path = path
+        self.timeout = timeout
+        self.stale = stale
+        self.poll = poll
+        self.logger = logging.getLogger("ckpt.lock")
+        self.stopped = None
+        self.content = None
+
+    def __enter__(self):
+        self.acquire()
+
+        return self
+
+    def __exit__(self, *exc_details):
+        self.release()
+
+    def _read(self, path):
+        try:
+            with open(path) as fd:
+                return fd.read()
+        except OSError:
+            return None
+
+    def is_stale(self, content=None):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return False
+
+        if time.time() - mtime > self.stale:
+            return True
+
+        if content is None:
+            content = self._read(self.path)
+
+        try:
+            host, pid = content.split()[:2]
+            pid = int(pid)
+        except (AttributeError, ValueError):
+            return False
+
+        if host == socket.gethostname():
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+
+        return False
+
+    def _remove(self, content):
+        """Remove the lock file if it still holds `content`.
+
+        The file is renamed to a unique name first, so of several
+        processes removing the same lock only one succeeds, and a lock
+        taken by someone else in the meantime is put back.
+        """
+        moved = "{}.{}".format(self.path, uuid.uuid4().hex)
+
+        try:
+            os.rename(self.path, moved)
+        except FileNotFoundError:
+            return False
+
+        try:
+            if self._read(moved) == content:
+                return True
+
+            try:
+                os.link(moved, self.path)
+            except OSError:
+                pass
+
+            return False
+        finally:
+            os.remove(moved)
+
+    def acquire(self, blocking=True):
+        start = time.time()
+        waiting = False
+
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                content = self._read(self.path)
+
+                if content is not None and self.is_stale(content):
+                    if self._remove(content):
+                        self.logger.warning("Broke stale lock {}"
+                                            .format(self.path))
+
+                    continue
+
+                if not blocking:
+                    return False
+
+                if self.timeout is not None \
+                   and time.time() - start > self.timeout:
+                    raise LockTimeout(self.path)
+
+                if not waiting:
+                    self.logger.info("Waiting for lock {}".format(self.path))
+                    waiting = True
+
+                time.sleep(self.poll)
+                continue
+
+            # The token tells this holder's lock file apart from a later
+            # one, should this one be broken as stale
+            self.content = "{} {} {}".format(socket.gethostname(),
+                                             os.getpid(), uuid.uuid4().hex)
+
+            with os.fdopen(fd, "w") as fd:
+                fd.write(self.content)
+
+            self._start_heartbeat()
+
+            return True
+
+    def _start_heartbeat(self):
+        self.stopped = threading.Event()
+
+        def heartbeat(stopped):
+            while not stopped.wait(self.stale / 4):
+                try:
+                    os.utime(self.path)
+                except FileNotFoundError:
+                    break
+
+        thread = threading.Thread(target=heartbeat, args=(self.stopped,),
+                                  daemon=True)
+        thread.start()
+
+    def release(self):
+        if self.stopped:
+            self.stopped.set()
+            self.stopped = None
+
+        if self.content is not None:
+            if not self._remove(self.content):
+                self.logger.warning("Lock {} was broken while held"
+                                    .format(self.path))
+
+            self.content = None
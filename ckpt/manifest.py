@@ -0,0 +1,64 @@
+import os
+import os.path
+import json
+
+MANIFEST_FILENAME = "MANIFEST.json"
+
+# Published manifests, by checkpoint path, along with the stat of the
+# manifest file they were read from
+manifests = {}
+
+def get_manifest_path(path):
+    return os.path.join(path, MANIFEST_FILENAME)
+
+def _stat_key(path):
+    stat = os.stat(get_manifest_path(path))
+
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+def load_manifest(path, refresh=False):
+    """Manifest of the checkpoint in `path`, or None if it has none.
+
+    Manifests are cached, as published checkpoints only change when
+    files are added to them. A cached manifest is only used while a
+    stat of the file matches, so a checkpoint evicted or extended by
+    another process is noticed. Pass `refresh` to read it regardless.
+    """
+    try:
+        key = _stat_key(path)
+    except FileNotFoundError:
+        forget_manifest(path)
+        return None
+
+    if not refresh and path in manifests and manifests[path][0] == key:
+        return manifests[path][1]
+
+    try:
+        with open(get_manifest_path(path)) as fd:
+            manifest = json.load(fd)
+    except FileNotFoundError:
+        forget_manifest(path)
+        return None
+
+    manifests[path] = (key, manifest)
+
+    return manifest
+
+def write_manifest(path, manifest):
+    filename = get_manifest_path(path)
+    tmp = "{}.{}".format(filename, os.getpid())
+
+    with open(tmp, "w") as fd:
+        json.dump(manifest, fd, sort_keys=True)
+
+    os.replace(tmp, filename)
+
+def save_manifest(path, manifest):
+    write_manifest(path, manifest)
+    cache_manifest(path, manifest)
+
+def cache_manifest(path, manifest):
+    manifests[path] = (_stat_key(path), manifest)
+
+def forget_manifest(path):
+    manifests.pop(path, None)
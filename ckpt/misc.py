@@ -1,9 +1,14 @@
 import os
+import sys
 import json
 import hashlib
 import csv
 import inspect
 import pickle
+import itertools
+
+import types
+import functools
 
 from functools import wraps
 from contextlib import contextmanager
@@ -33,6 +38,41 @@ def add_defaults(config, defaults):
                   else config[key])
             for key, value in defaults.items()}
 
+def flatten(d):
+    flattened = {}
+
+    for k, v in d.items():
+        if isinstance(v, dict):
+            for k2, v2 in flatten(v).items():
+                flattened["{}-{}".format(k, k2)] = v2
+        else:
+            flattened[k] = v
+
+    return flattened
+
+SIZE_UNITS = {"": 1, "K": 2**10, "M": 2**20, "G": 2**30, "T": 2**40}
+
+def parse_size(size):
+    """Parse a size in bytes, such as `1024`, `"512M"` or `"50G"`."""
+    if isinstance(size, (int, float)):
+        return int(size)
+
+    size = size.strip().upper().rstrip("B")
+    unit = size[-1:] if size[-1:] in SIZE_UNITS else ""
+
+    return int(float(size[:len(size) - len(unit)]) * SIZE_UNITS[unit])
+
+def format_size(size):
+    for unit in ("", "K", "M", "G"):
+        if abs(size) < 1024:
+            break
+
+        size /= 1024
+    else:
+        unit = "T"
+
+    return "{:.1f}{}".format(size, unit) if unit else "{}".format(size)
+
 def save_as_json(data, filename):
     with open(filename, "w") as fd:
         json.dump(data, fd)
@@ -59,6 +99,17 @@ def save_as_csv(data, filename, headers=None):
         for row in data:
             writer.writerow(row)
 
+def batched(iterable, n):
+    iterator = iter(iterable)
+
+    while True:
+        batch = list(itertools.islice(iterator, n))
+
+        if not batch:
+            break
+
+        yield batch
+
 def mark_final(iterable):
     prev = None
 
@@ -70,6 +121,69 @@ def mark_final(iterable):
 
     yield True, prev
 
+def is_array(item):
+    """Whether `item` is an array `Checkpoint.save_array` can store
+    without pickling, which excludes arrays of objects."""
+    np = sys.modules.get("numpy")
+    sparse = sys.modules.get("scipy.sparse")
+
+    if not ((np and isinstance(item, np.ndarray))
+            or (sparse and sparse.issparse(item))):
+        return False
+
+    return not item.dtype.hasobject
+
+def num_rows(X):
+    shape = getattr(X, "shape", None)
+
+    return shape[0] if shape is not None else len(X)
+
+def slice_rows(X, start, stop):
+    # Positional slicing for pandas objects
+    if hasattr(X, "iloc"):
+        return X.iloc[start:stop]
+
+    return X[start:stop]
+
+def is_sliceable(X):
+    return hasattr(X, "__getitem__") and (hasattr(X, "shape")
+                                          or hasattr(X, "__len__"))
+
+def iter_chunks(X, chunk_size):
+    """Split `X` into chunks of at most `chunk_size` rows.
+
+    Arrays, including memmaps, data frames and sequences are sliced, so
+    only the chunk being processed is read into memory. Anything else
+    is taken to be an iterable of batches, each of which is split
+    further if it is larger than `chunk_size`.
+    """
+    if is_sliceable(X):
+        for start in range(0, num_rows(X), chunk_size):
+            yield slice_rows(X, start, start + chunk_size)
+    else:
+        for batch in X:
+            yield from iter_chunks(batch, chunk_size)
+
+def concatenate(chunks):
+    """Join chunks split by `iter_chunks` back together."""
+    chunks = list(chunks)
+
+    if not chunks:
+        return []
+
+    first = chunks[0]
+    np = sys.modules.get("numpy")
+    sparse = sys.modules.get("scipy.sparse")
+
+    if sparse and sparse.issparse(first):
+        return sparse.vstack(chunks)
+    elif np and isinstance(first, np.ndarray):
+        return np.concatenate(chunks)
+    elif hasattr(first, "iloc"):
+        return sys.modules["pandas"].concat(chunks)
+
+    return [item for chunk in chunks for item in chunk]
+
 def get_hash(item):
     m = hashlib.sha256()
 
@@ -77,6 +191,103 @@ def get_hash(item):
 
     return m.hexdigest()
 
+def get_function_hash(fn):
+    """Fingerprint of a function's code, used to invalidate results
+    computed with an older version of it.
+
+    Stable across processes: partials are hashed by their function and
+    arguments, and closures by the values they close over, rather than
+    by a repr that holds a memory address.
+    """
+    m = hashlib.sha256()
+
+    _update_function_hash(m, fn, set())
+
+    return m.hexdigest()
+
+def _update_function_hash(m, fn, seen):
+    # Recursive closures refer to themselves
+    if id(fn) in seen:
+        m.update(b"recursive")
+        return
+
+    seen.add(id(fn))
+
+    if isinstance(fn, functools.partial):
+        m.update(b"partial")
+        _update_function_hash(m, fn.func, seen)
+        _update_value_hash(m, fn.args, seen)
+        _update_value_hash(m, fn.keywords, seen)
+        return
+
+    m.update(str(getattr(fn, "__module__", "")).encode("utf-8"))
+    m.update(str(getattr(fn, "__qualname__", "")).encode("utf-8"))
+
+    code = getattr(fn, "__code__", None)
+
+    try:
+        source = inspect.getsource(fn)
+        m.update(source.encode("utf-8"))
+    except (OSError, TypeError):
+        source = None
+
+    if code is None:
+        if source is None:
+            # Builtins and callable objects
+            _update_value_hash(m, fn, seen)
+
+        return
+
+    # The source of a lambda is the whole line it is defined on, which
+    # may define others
+    if source is None or fn.__name__ == "<lambda>":
+        _update_code_hash(m, code)
+
+    cells = []
+
+    for cell in fn.__closure__ or ():
+        try:
+            cells.append(cell.cell_contents)
+        except ValueError:
+            # Not assigned yet
+            cells.append(None)
+
+    _update_value_hash(m, (fn.__defaults__, fn.__kwdefaults__, cells), seen)
+
+def _update_code_hash(m, code):
+    m.update(code.co_code)
+    m.update(repr(code.co_names).encode("utf-8"))
+
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _update_code_hash(m, const)
+        else:
+            m.update(repr(const).encode("utf-8"))
+
+def _update_value_hash(m, value, seen):
+    if isinstance(value, (list, tuple)):
+        m.update("{}:{}".format(type(value).__name__,
+                                len(value)).encode("utf-8"))
+
+        for item in value:
+            _update_value_hash(m, item, seen)
+    elif isinstance(value, dict):
+        m.update("dict:{}".format(len(value)).encode("utf-8"))
+
+        for key, item in sorted(value.items(),
+                                key=lambda item: repr(item[0])):
+            _update_value_hash(m, key, seen)
+            _update_value_hash(m, item, seen)
+    elif isinstance(value, (functools.partial, types.FunctionType)):
+        _update_function_hash(m, value, seen)
+    else:
+        # Objects are hashed by their state, and classes and builtins
+        # by reference
+        try:
+            m.update(pickle.dumps(value, protocol=4))
+        except Exception:
+            m.update(repr(value).encode("utf-8"))
+
 def get_file_hash(filename, blocksize=2**20):
     m = hashlib.sha256()
 
@@ -91,17 +302,31 @@ def get_file_hash(filename, blocksize=2**20):
 
     return m.hexdigest()
 
-def shortest_unique_prefix(lst, minimum=None):
-    n = len(lst)
+class AmbiguousIdError(ValueError):
+    pass
+
+def common_prefix_length(a, b):
+    n = 0
 
-    for i in range(1, n + 1):
-        prefixes = set(item[:i] for item in lst)
+    for x, y in zip(a, b):
+        if x != y:
+            break
 
-        if len(prefixes) == n:
-            if minimum:
-                return max([i, minimum])
-            else:
-                return i
+        n += 1
+
+    return n
+
+def shortest_unique_prefix(lst, minimum=None):
+    # In sorted order, an item shares its longest prefix with one of
+    # its neighbours.
+    items = sorted(lst)
+    k = 1 + max((common_prefix_length(a, b)
+                 for a, b in zip(items, items[1:])), default=0)
+
+    if minimum:
+        return max([k, minimum])
+    else:
+        return k
 
 def get_short_hashes(hashes, minimum=7):
     k = shortest_unique_prefix(hashes, minimum)
@@ -109,11 +334,19 @@ def get_short_hashes(hashes, minimum=7):
     return [item[:k] for item in hashes]
 
 def get_long_hash(short_hash):
-    path = os.path.join(get_ckpt_path(), "experiments")
+    """Filename of the experiment with id starting with `short_hash`.
+
+    Returns None if there is no such experiment, and raises
+    `AmbiguousIdError` if there is more than one.
+    """
+    from .index import ExperimentIndex
+
+    with ExperimentIndex() as index:
+        index.sync()
+        ex_id = index.resolve(short_hash)
 
-    for filename in os.listdir(path):
-        if filename.startswith(short_hash):
-            return filename
+        if ex_id:
+            return os.path.basename(index.get_filename(ex_id))
 
 def autoinit(fn):
     @wraps(fn)
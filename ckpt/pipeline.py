@@ -1,11 +1,17 @@
-from .misc import mark_final
+from .misc import mark_final, iter_chunks, concatenate
+from .fingerprint import fingerprint, Fingerprint
+from .results import is_header, load_experiment
+from .profile import profile
 
 from functools import wraps
-from collections import OrderedDict
+from itertools import repeat
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import json
 import pickle
 import logging
+import multiprocessing
 
 def lazy(fn):
     @wraps(fn)
@@ -20,26 +26,82 @@ def lazy(fn):
 def load_config(filename):
     if filename.endswith("json"):
         with open(filename) as fd:
-            return json.load(open(filename), object_pairs_hook=OrderedDict)
+            data = json.load(fd, object_pairs_hook=OrderedDict)
+
+        # Experiment headers hold the config of the experiment
+        if is_header(data):
+            return load_experiment(filename)['config']
+
+        return data
     elif filename.endswith("pkl"):
         with open(filename, "rb") as fd:
             data = pickle.load(fd)
             return data['config']
 
+# Whether `Pipeline.fit` uses checkpoints unless told otherwise, see
+# `set_use_checkpoints`
+checkpoints_enabled = True
+
+def set_use_checkpoints(enabled):
+    global checkpoints_enabled
+
+    checkpoints_enabled = enabled
+
+def get_use_checkpoints():
+    return checkpoints_enabled
+
+worker_pipeline = None
+
+def _init_worker(pipeline):
+    global worker_pipeline
+
+    worker_pipeline = pipeline
+
+def _predict_worker(X):
+    return worker_pipeline.predict(X)
+
+def transform_chunks(pipes, chunks):
+    for X, y in chunks:
+        for pipe in pipes:
+            with profile(pipe.get_name(), "transform"):
+                X, y = pipe.transform(X, y)
+
+        yield X, y
+
+def get_executor(executor, jobs, pipeline):
+    if executor == "thread":
+        return ThreadPoolExecutor(max_workers=jobs)
+    elif executor == "process":
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            context = multiprocessing.get_context()
+
+        return ProcessPoolExecutor(max_workers=jobs, mp_context=context,
+                                   initializer=_init_worker,
+                                   initargs=(pipeline,))
+    else:
+        raise ValueError("Unknown executor '{}', use 'thread' or 'process'"
+                         .format(executor))
 
 class Pipeline(object):
-    def __init__(self, pipes):
+    def __init__(self, pipes, cache_values=()):
         self.labels, self.pipes = list(zip(*pipes))
+        self.checkpoints = []
         self.logger = logging.getLogger("ckpt.pipeline")
 
+        for label, pipe in zip(self.labels, self.pipes[:-1]):
+            if cache_values is True or label in cache_values:
+                pipe.cache_values = True
+
     @classmethod
-    def from_file(cls, filename, pipes):
-        return cls.from_dict(load_config(filename), pipes)
+    def from_file(cls, filename, pipes, **kwargs):
+        return cls.from_dict(load_config(filename), pipes, **kwargs)
 
     @classmethod
-    def from_dict(cls, d, pipes):
+    def from_dict(cls, d, pipes, **kwargs):
         return cls([(label, pipes[label](**config))
-                    for label, config in d.items()])
+                    for label, config in d.items()], **kwargs)
 
     def get_name(self):
         return "+".join(self.labels)
@@ -48,19 +110,219 @@ class Pipeline(object):
         return OrderedDict(((label, pipe.get_params(show_defaults))
                             for label, pipe in zip(self.labels, self.pipes)))
 
-    def fit(self, X, y=None, use_checkpoints=True):
+    def get_checkpoints(self, X, y=None):
+        # Only the raw input is fingerprinted, every later stage is
+        # keyed on its upstream checkpoint and its own params.
+        with profile(self.get_name(), "hash"):
+            data_hash = fingerprint((X, y))
+
+        return self.get_chained_checkpoints(data_hash)
+
+    def get_chained_checkpoints(self, data_hash):
+        checkpoints = []
+        ckpt = None
+
+        for pipe in self.pipes:
+            ckpt = pipe.get_checkpoint(None if ckpt else data_hash, ckpt)
+            checkpoints.append(ckpt)
+
+        return checkpoints
+
+    def get_lineage(self):
+        return [(label, ckpt.get_hash())
+                for label, ckpt in zip(self.labels, self.checkpoints)]
+
+    def fit(self, X, y=None, use_checkpoints=None, chunk_size=None,
+            fit_params=None):
+        """Fit the pipeline.
+
+        To fit on data that doesn't fit in memory, pass `chunk_size` to
+        have `X` and `y` split by `iter_chunks`, or make `X` a function
+        returning a fresh iterator of `(X, y)` chunks on every call. See
+        `fit_stream`.
+
+        Checkpoints are used unless `use_checkpoints` is False, or
+        disabled with `set_use_checkpoints`.
+        """
+        if use_checkpoints is None:
+            use_checkpoints = checkpoints_enabled
+
+        if chunk_size or callable(X):
+            return self.fit_stream(X, y, chunk_size, use_checkpoints,
+                                   fit_params)
+
         self.logger.info("Fitting pipeline {}".format(self.get_name()))
 
-        for is_final, pipe in mark_final(self.pipes):
-            pipe._fit(X, y, use_checkpoints)
+        if not use_checkpoints:
+            for is_final, pipe in mark_final(self.pipes):
+                pipe._fit(X, y, use_checkpoints)
 
-            if not is_final:
-                X, y = pipe.transform(X, y)
+                if not is_final:
+                    with profile(pipe.get_name(), "transform"):
+                        X, y = pipe.transform(X, y)
+
+            return
+
+        self.checkpoints = self.get_checkpoints(X, y)
+        cached = None
+        pending = []
+
+        # Transforms are only applied once a stage actually needs to be
+        # fitted, starting from the deepest stage with cached output, so
+        # a fully cached pipeline never materialises any intermediate
+        # data.
+        def get_data():
+            nonlocal X, y, cached
+
+            if cached:
+                pipe, ckpt = cached
+                cached = None
+
+                self.logger.info("Loading transformed data from {}"
+                                 .format(ckpt.get_path()))
+                with profile(pipe.get_name(), "load_values"):
+                    X, y = pipe.load_values(ckpt)
+
+            while pending:
+                pipe, ckpt = pending.pop(0)
+
+                with profile(pipe.get_name(), "transform"):
+                    X, y = pipe.transform(X, y)
+
+                if pipe.cache_values:
+                    self.save_values(pipe, ckpt, X, y)
+
+            return X, y
+
+        for is_final, (pipe, ckpt) in mark_final(zip(self.pipes,
+                                                     self.checkpoints)):
+            pipe._fit_checkpoint(ckpt, get_data)
+
+            if is_final:
+                break
+
+            if pipe.cache_values and pipe.has_values(ckpt):
+                cached = (pipe, ckpt)
+                del pending[:]
+            else:
+                pending.append((pipe, ckpt))
+
+    def save_values(self, pipe, ckpt, X, y):
+        # Values are only added next to the model. A model from the
+        # model cache may not be on disk anymore.
+        with ckpt.extend() as published:
+            if not published:
+                self.logger.debug("Not caching values of {}, its model is "
+                                  "not saved".format(pipe.get_name()))
+                return
+
+            with profile(pipe.get_name(), "save_values"):
+                pipe.save_values(ckpt, X, y)
+
+    def fingerprint_stream(self, get_chunks):
+        """Fingerprint of the raw chunks, read in a pass of their own.
+
+        The fingerprint is over the chunks as given. Chunking the same
+        data differently gives different checkpoints.
+        """
+        m = Fingerprint()
+
+        with profile(self.get_name(), "hash"):
+            for chunk in get_chunks():
+                m.update(chunk)
+
+        return m.hexdigest()
+
+    def fit_stream(self, X, y=None, chunk_size=None, use_checkpoints=None,
+                   fit_params=None):
+        """Fit the pipeline one chunk at a time with `partial_fit`.
+
+        Stages are fitted in order. Each stage is fitted on the chunks
+        streamed through the already fitted stages before it, so the
+        data is read once per stage that needs fitting, but never held
+        in memory as a whole.
+        `fit_params` maps pipe labels to extra `partial_fit` arguments,
+        such as the `classes` of an `SGDClassifier`. Transformed values
+        are not cached.
+
+        With checkpoints, the data is read once more beforehand to
+        fingerprint it, as the fingerprint decides which stages need
+        fitting at all.
+        """
+        self.logger.info("Fitting pipeline {} on chunks"
+                         .format(self.get_name()))
+        fit_params = fit_params or {}
+
+        if use_checkpoints is None:
+            use_checkpoints = checkpoints_enabled
+
+        if callable(X):
+            get_chunks = X
+        else:
+            def get_chunks():
+                return zip(iter_chunks(X, chunk_size),
+                           repeat(None) if y is None
+                           else iter_chunks(y, chunk_size))
+
+        if use_checkpoints:
+            self.checkpoints = self.get_chained_checkpoints(
+                self.fingerprint_stream(get_chunks))
+
+        for i, (label, pipe) in enumerate(zip(self.labels, self.pipes)):
+            def get_data(upstream=self.pipes[:i]):
+                return transform_chunks(upstream, get_chunks())
+
+            if use_checkpoints:
+                pipe._fit_checkpoint(self.checkpoints[i], get_data,
+                                     stream=True,
+                                     **fit_params.get(label, {}))
+            else:
+                with profile(pipe.get_name(), "fit"):
+                    pipe.fit_chunks(get_data(), **fit_params.get(label, {}))
 
     def predict(self, X):
         y = None
 
         for pipe in self.pipes[:-1]:
-            X, y = pipe.transform(X, y)
+            with profile(pipe.get_name(), "transform"):
+                X, y = pipe.transform(X, y)
+
+        with profile(self.pipes[-1].get_name(), "predict"):
+            return self.pipes[-1].predict(X)
+
+    def predict_iter(self, X, chunk_size=10000, jobs=1, executor="thread"):
+        """Predict `X` in chunks of `chunk_size` rows, yielding the
+        predictions for each chunk in order.
+
+        `X` is an array, a memmap or anything else `iter_chunks`
+        accepts, such as an iterator of batches. Memory use is bounded
+        by the chunk size rather than the size of `X`. With `jobs` > 1,
+        chunks are predicted on a pool of threads, or processes with
+        `executor="process"`, with at most two chunks per job in flight.
+        """
+        chunks = iter_chunks(X, chunk_size)
+
+        if jobs == 1:
+            for chunk in chunks:
+                yield self.predict(chunk)
+
+            return
+
+        with get_executor(executor, jobs, self) as pool:
+            predict = (self.predict if executor == "thread"
+                       else _predict_worker)
+            pending = deque()
+
+            for chunk in chunks:
+                pending.append(pool.submit(predict, chunk))
+
+                if len(pending) >= 2 * jobs:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
 
-        return self.pipes[-1].predict(X)
+    def predict_chunked(self, X, chunk_size=10000, jobs=1,
+                        executor="thread"):
+        """Like `predict_iter`, but returns all predictions joined."""
+        return concatenate(self.predict_iter(X, chunk_size, jobs, executor))
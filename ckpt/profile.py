@@ -0,0 +1,125 @@
+import sys
+import time
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+def get_io():
+    """Bytes read and written by the process so far, or `(None, None)`
+    where the platform doesn't tell."""
+    try:
+        with open("/proc/self/io") as fd:
+            fields = dict(line.split(":") for line in fd)
+
+        return int(fields['rchar']), int(fields['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+def get_peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Reported in bytes on macOS, kilobytes elsewhere
+    return rss if sys.platform == "darwin" else rss * 1024
+
+def get_cpu_time():
+    # Work done on the main thread may be spread over threads of e.g.
+    # BLAS, background threads only count their own
+    if threading.current_thread() is threading.main_thread():
+        return time.process_time()
+
+    return time.thread_time()
+
+def _delta(start, stop):
+    if start is None or stop is None:
+        return None
+
+    return stop - start
+
+class Profiler(object):
+    """Records wall time, CPU time, bytes read and written and peak RSS
+    of pipeline stages."""
+
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, event, **info):
+        record = OrderedDict((("name", name), ("event", event)))
+        record.update(info)
+
+        read, written = get_io()
+        cpu = get_cpu_time()
+        start = time.perf_counter()
+
+        try:
+            yield record
+        finally:
+            record['wall'] = time.perf_counter() - start
+            record['cpu'] = get_cpu_time() - cpu
+
+            stop_read, stop_written = get_io()
+            record['read'] = _delta(read, stop_read)
+            record['written'] = _delta(written, stop_written)
+            record['rss'] = get_peak_rss()
+
+            with self.lock:
+                self.records.append(record)
+
+profiler = None
+
+def start_profiling():
+    global profiler
+
+    profiler = Profiler()
+
+    return profiler
+
+def stop_profiling():
+    """Stop profiling and return the records."""
+    global profiler
+
+    records, profiler = (profiler.records if profiler else []), None
+
+    return records
+
+@contextmanager
+def profile(name, event, **info):
+    """Profile a stage if profiling is on, i.e. inside an experiment."""
+    if profiler is None:
+        yield {}
+    else:
+        with profiler.stage(name, event, **info) as record:
+            yield record
+
+def summarize(records):
+    """Totals per (name, event) and the peak RSS over all records."""
+    summary = OrderedDict()
+    peak_rss = None
+
+    for record in records:
+        key = (record['name'], record['event'])
+
+        if key not in summary:
+            summary[key] = {"calls": 0, "wall": 0.0, "cpu": 0.0,
+                            "read": None, "written": None}
+
+        totals = summary[key]
+        totals['calls'] += 1
+        totals['wall'] += record['wall']
+        totals['cpu'] += record['cpu']
+
+        for field in ("read", "written"):
+            if record.get(field) is not None:
+                totals[field] = (totals[field] or 0) + record[field]
+
+        if record.get('rss') is not None:
+            peak_rss = max(peak_rss or 0, record['rss'])
+
+    return summary, peak_rss
@@ -1,16 +1,21 @@
 import os
 import os.path
-import pickle
+import heapq
+import hashlib
+import itertools
 import pprint
-import numpy as np
 
 from collections import defaultdict
-from tabulate import tabulate
-from sklearn.metrics import confusion_matrix
 
-from .misc import get_ckpt_path, load_json, get_short_hashes
-from .config import ckpt_config
+from .misc import get_ckpt_path, load_json, flatten, batched, format_size
+from .config import get_config
 from .experiment import get_metrics, get_reports
+from .results import remove_experiment_files
+from .profile import summarize
+from .index import (ExperimentIndex, get_experiment_id, get_score_names,
+                    compute_metrics, compute_metrics_parallel)
+
+BATCH_SIZE = 1000
 
 def common_prefix(lists):
     n = 0
@@ -23,29 +28,18 @@ def common_prefix(lists):
 
     return n
 
-def flatten(d):
-    flattened = {}
-
-    for k, v in d.items():
-        if isinstance(v, dict):
-            for k2, v2 in flatten(v).items():
-                flattened["{}-{}".format(k, k2)] = v2
-        else:
-            flattened[k] = v
-
-    return flattened
-
-def prune(rows):
+def get_varying_keys(configs):
     values = defaultdict(set)
 
-    for _, _, config, _ in rows:
+    for config in configs:
         for k, v in config.items():
             values[k].add(str(v))
 
-    keys = set(k for k, v in values.items()
+    return set(k for k, v in values.items()
                if len(v) > 1)
 
-    pruned = []
+def prune(rows, keys):
+    seen = set()
 
     for short_hash, name, config, metrics in rows:
         row = (short_hash, name,
@@ -53,58 +47,110 @@ def prune(rows):
                 if k in keys},
                metrics)
 
-        if not row in pruned:
-            pruned.append(row)
+        digest = hashlib.sha1(repr(row).encode("utf-8")).digest()
 
-    return pruned
+        if digest not in seen:
+            seen.add(digest)
+            yield row
 
-def load_experiments(ids=None):
-    path = os.path.join(get_ckpt_path(), "experiments")
+def select_experiments(index, ids=None):
+    k = max(index.get_prefix_length(), 7)
 
-    filenames = os.listdir(path)
-    short_hashes = get_short_hashes(filenames, minimum=7)
+    if ids:
+        ex_ids = [ex_id for ex_id in map(index.resolve, ids)
+                  if ex_id]
+    else:
+        ex_ids = index.get_ids()
 
-    for short_hash, experiment in zip(short_hashes, filenames):
-        with open(os.path.join(path, experiment), "rb") as fd:
-            data = pickle.load(fd)
+    for ex_id in ex_ids:
+        yield ex_id[:k], ex_id
 
-        if not ids or short_hash in ids:
-            yield short_hash, data
+def load_experiments(ids=None):
+    with ExperimentIndex() as index:
+        index.sync()
 
-def get_experiments(ids=None, pipe=None, config_filter=None):
-    experiments = []
+        for short_hash, ex_id in select_experiments(index, ids):
+            yield short_hash, index.load(ex_id)
 
-    for short_hash, data in load_experiments(ids):
-        # For new style experiments, the results are saved and metrics
-        # calculated later, while old style saves only metrics at
-        # experiment time.
+def filter_experiments(index, ids=None, pipe=None, config_filter=None):
+    for short_hash, ex_id in select_experiments(index, ids):
+        data = index.get(ex_id)
 
         if pipe and pipe not in data['config']:
             continue
 
-        if "results" in data:
-            if not "metrics" in data:
-                data['metrics'] = {}
-
-            for name, result in data['results'].items():
-                for metric, fn in get_metrics().items():
-                    score = fn(result['y_true'], result['y_pred'])
-                    data['metrics']["{}-{}".format(name, metric)] = score
-
         config = flatten(data['config'])
-        remove = False
 
-        if config_filter:
-            for key, value in config_filter.items():
-                if not key in config or config[key] != value:
-                    remove = True
-        if remove:
+        if not matches_filter(config, config_filter):
             continue
 
-        experiments.append((short_hash, [key for key in data['config'].keys()],
-                            config, data['metrics']))
+        yield (short_hash, ex_id, [key for key in data['config'].keys()],
+               config, data['results'])
+
+def score_experiments(index, rows, metrics, jobs=1):
+    # Rows are scored in batches, so stale metrics can be computed in
+    # parallel without holding every row in memory.
+    for batch in batched(rows, BATCH_SIZE):
+        experiments = []
+        stale = []
 
-    return prune(experiments)
+        for short_hash, ex_id, name, config, results in batch:
+            # For new style experiments, the results are saved and
+            # metrics calculated later, while old style saves only
+            # metrics at experiment time. Metrics are cached in the
+            # index, so only new experiments or metrics are computed.
+            scores, keys = index.get_scores(ex_id, metrics, results)
+
+            if keys:
+                stale.append((len(experiments), ex_id, keys))
+
+            experiments.append((short_hash, name, config, scores))
+
+        if jobs > 1 and len(stale) > 1:
+            computed = compute_metrics_parallel(
+                jobs, metrics, [(index.get_filename(ex_id), keys)
+                                for _, ex_id, keys in stale])
+        else:
+            computed = (compute_metrics(index.load(ex_id)['results'],
+                                        metrics, keys)
+                        for _, ex_id, keys in stale)
+
+        for (i, ex_id, _), scores in zip(stale, computed):
+            with index.db:
+                index.add_scores(ex_id, scores, metrics)
+
+            experiments[i][3].update(scores)
+
+        for short_hash, name, config, scores in experiments:
+            yield short_hash, name, config, get_score_names(scores)
+
+def get_experiments(ids=None, pipe=None, config_filter=None, jobs=1):
+    """Generate report rows: filter, flatten, score and prune.
+
+    The index is read twice, first to find which config keys vary
+    between experiments, then to stream the rows themselves.
+    """
+    metrics = get_metrics()
+
+    with ExperimentIndex() as index:
+        # New experiments are scored with the rest of the stale
+        # metrics, in parallel
+        index.sync()
+
+        keys = get_varying_keys(config for _, _, _, config, _ in
+                                filter_experiments(index, ids, pipe,
+                                                   config_filter))
+        rows = filter_experiments(index, ids, pipe, config_filter)
+
+        yield from prune(score_experiments(index, rows, metrics, jobs), keys)
+
+def matches_filter(config, config_filter):
+    if config_filter:
+        for key, value in config_filter.items():
+            if not key in config or config[key] != value:
+                return False
+
+    return True
 
 def values_from_keys(d, keys, default=None):
     return [d[k] if k in d
@@ -122,7 +168,41 @@ def default_value(config, default, *keys):
 
     return set(d)
 
-def tabulate_data(experiments, sort_by=None, reverse_sort=True):
+def sort_key(value, reverse_sort=True):
+    # Rows missing a value sort last, in either direction
+    if reverse_sort:
+        return (value is not None, value)
+
+    return (value is None, value)
+
+def get_row_value(row, key):
+    short_hash, name, config, metrics = row
+
+    if key == "id":
+        return short_hash
+    elif key == "name":
+        return "+".join(name)
+    elif key == "config":
+        return "; ".join("{}: {}".format(k, config[k])
+                         for k in sorted(config))
+    else:
+        return metrics.get(key)
+
+def top_k(experiments, sort_by, k, reverse_sort=True):
+    select = heapq.nlargest if reverse_sort else heapq.nsmallest
+
+    return select(k, experiments,
+                  key=lambda row: sort_key(get_row_value(row, sort_by),
+                                           reverse_sort))
+
+def tabulate_data(experiments, sort_by=None, reverse_sort=True, limit=None):
+    if limit and sort_by:
+        experiments = top_k(experiments, sort_by, limit, reverse_sort)
+    elif limit:
+        experiments = itertools.islice(experiments, limit)
+
+    experiments = list(experiments)
+
     config_keys = set([])
     metrics_keys = set([])
     names = []
@@ -132,9 +212,9 @@ def tabulate_data(experiments, sort_by=None, reverse_sort=True):
         metrics_keys.update(metrics.keys())
         names.append(name)
 
-    config_keys = sorted(config_keys - default_value(ckpt_config, set([]),
+    config_keys = sorted(config_keys - default_value(get_config(), set([]),
                                                      "report", "ignore-config"))
-    metrics_keys = sorted(metrics_keys - default_value(ckpt_config, set([]),
+    metrics_keys = sorted(metrics_keys - default_value(get_config(), set([]),
                                                        "report", "ignore-metrics"))
 
     name_start = common_prefix(names)
@@ -150,17 +230,34 @@ def tabulate_data(experiments, sort_by=None, reverse_sort=True):
 
     if sort_by:
         index = headers.index(sort_by)
-        data.sort(key = lambda row : row[index], reverse=reverse_sort)
+        data.sort(key = lambda row : sort_key(row[index], reverse_sort),
+                  reverse=reverse_sort)
 
     return data, headers
 
 def pretty_print(data, headers, floatfmt=".4f"):
+    from tabulate import tabulate
+
     return print(tabulate(data, headers=headers, floatfmt=floatfmt))
 
 def remove_experiment(filename):
-    os.remove(os.path.join(get_ckpt_path(), "experiments", filename))
+    remove_experiment_files(os.path.join(get_ckpt_path(), "experiments",
+                                         filename))
+
+    with ExperimentIndex() as index:
+        index.remove(get_experiment_id(filename))
+
+def rebuild_index(jobs=1):
+    with ExperimentIndex() as index:
+        index.rebuild()
+
+        for _ in score_experiments(index, filter_experiments(index),
+                                   get_metrics(), jobs):
+            pass
 
 def inspect_experiment(ex_id):
+    import numpy as np
+
     _, ex = list(load_experiments([ex_id]))[0]
 
     print("Experiment {}:".format(ex_id))
@@ -179,3 +276,62 @@ def inspect_experiment(ex_id):
                      ("Std", np.std),
                      ("Median", np.median)):
         print("{}: {}".format(name, fn(results['y_pred'])))
+
+def load_profiles(ids):
+    with ExperimentIndex() as index:
+        index.sync()
+
+        for short_hash, ex_id in select_experiments(index, ids):
+            yield short_hash, index.get(ex_id)['metadata'].get("profile")
+
+def format_bytes(size):
+    return "-" if size is None else format_size(size)
+
+def tabulate_profile(records):
+    summary, peak_rss = summarize(records)
+    headers = ["stage", "event", "calls", "wall", "cpu", "read", "written"]
+    data = [[name, event, totals['calls'], totals['wall'], totals['cpu'],
+             format_bytes(totals['read']), format_bytes(totals['written'])]
+            for (name, event), totals in summary.items()]
+
+    return data, headers, peak_rss
+
+def compare_profiles(profiles):
+    """Wall time per stage and event, one column per experiment."""
+    summaries = [(short_hash, summarize(records)[0])
+                 for short_hash, records in profiles]
+    keys = []
+
+    for _, summary in summaries:
+        keys.extend(key for key in summary if key not in keys)
+
+    headers = ["stage", "event"] + [short_hash for short_hash, _ in summaries]
+    data = [list(key) + [summary[key]['wall'] if key in summary else None
+                         for _, summary in summaries]
+            for key in keys]
+
+    return data, headers
+
+def profile_experiments(ids):
+    profiles = []
+
+    for short_hash, records in load_profiles(ids):
+        if records is None:
+            print("No profile recorded for experiment {}".format(short_hash))
+        else:
+            profiles.append((short_hash, records))
+
+    if len(profiles) == 1:
+        short_hash, records = profiles[0]
+        data, headers, peak_rss = tabulate_profile(records)
+        events = [record['event'] for record in records]
+
+        print("Experiment {}:".format(short_hash))
+        pretty_print(data, headers, floatfmt=".3f")
+        print()
+        print("Checkpoint hits: {}, misses: {}".format(
+            events.count("load") + events.count("cache"),
+            events.count("fit")))
+        print("Peak RSS: {}".format(format_bytes(peak_rss)))
+    elif profiles:
+        pretty_print(*compare_profiles(profiles), floatfmt=".3f")
@@ -0,0 +1,226 @@
+import os
+import os.path
+import sys
+import json
+import mmap
+import base64
+import pickle
+import struct
+
+from collections.abc import Mapping
+
+from .misc import get_ckpt_path, mkdirp
+
+# Marks a JSON file as an experiment header, as opposed to a pipeline
+# config.
+HEADER_KEY = "ckpt-experiment"
+HEADER_VERSION = 1
+
+EXTENSIONS = (".json", ".pkl")
+
+TYPE_KEY = "__ckpt_type__"
+
+RESULTS_MAGIC = b"CKPTRES1"
+RESULTS_HEADER = struct.Struct("<8sQQ")
+BUFFER_ENTRY = struct.Struct("<QQ")
+ALIGNMENT = 64
+
+def get_results_path():
+    return os.path.join(get_ckpt_path(), "results")
+
+def get_results_filename(filename):
+    ex_id = os.path.splitext(os.path.basename(filename))[0]
+
+    return os.path.join(get_results_path(), "{}.results".format(ex_id))
+
+def _align(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+def write_results(filename, results):
+    """Write results as a protocol 5 pickle with out-of-band buffers.
+
+    The pickle itself only holds the structure, the array data is
+    written straight from the arrays' memory after it, each buffer
+    aligned, so it can be mapped back without copies.
+    """
+    buffers = []
+    payload = pickle.dumps(results, protocol=5,
+                           buffer_callback=buffers.append)
+    views = [buf.raw() for buf in buffers]
+
+    offset = (RESULTS_HEADER.size + len(payload) +
+              BUFFER_ENTRY.size * len(views))
+    entries = []
+
+    for view in views:
+        offset = _align(offset)
+        entries.append((offset, view.nbytes))
+        offset += view.nbytes
+
+    with open(filename, "wb") as fd:
+        fd.write(RESULTS_HEADER.pack(RESULTS_MAGIC, len(payload), len(views)))
+        fd.write(payload)
+
+        for entry in entries:
+            fd.write(BUFFER_ENTRY.pack(*entry))
+
+        for (offset, _), view in zip(entries, views):
+            fd.write(b"\0" * (offset - fd.tell()))
+            fd.write(view)
+
+def read_results(filename):
+    """Read results written by `write_results`.
+
+    Arrays are read-only views of the memory mapped file.
+    """
+    with open(filename, "rb") as fd:
+        data = memoryview(mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ))
+
+    magic, size, count = RESULTS_HEADER.unpack_from(data)
+
+    if magic != RESULTS_MAGIC:
+        raise ValueError("Not a results file: {}".format(filename))
+
+    start = RESULTS_HEADER.size + size
+    buffers = [data[offset:offset + length]
+               for offset, length in BUFFER_ENTRY.iter_unpack(
+                       data[start:start + BUFFER_ENTRY.size * count])]
+
+    return pickle.loads(data[RESULTS_HEADER.size:start], buffers=buffers)
+
+def encode_value(value):
+    """Encode a value as JSON, without losing what JSON can't represent.
+
+    Tuples, dicts with keys other than strings, and numpy scalars are
+    tagged, anything else JSON has no type for is pickled. Dicts such
+    as `OrderedDict` are stored as JSON objects, which keep their key
+    order.
+    """
+    if value is None or type(value) in (str, bool, int, float):
+        return value
+    elif type(value) is list:
+        return [encode_value(item) for item in value]
+    elif type(value) is tuple:
+        return {TYPE_KEY: "tuple",
+                "items": [encode_value(item) for item in value]}
+    elif isinstance(value, dict):
+        if all(type(key) is str for key in value) and TYPE_KEY not in value:
+            return {key: encode_value(item) for key, item in value.items()}
+
+        return {TYPE_KEY: "dict",
+                "items": [[encode_value(key), encode_value(item)]
+                          for key, item in value.items()]}
+
+    np = sys.modules.get("numpy")
+
+    if np is not None and isinstance(value, np.generic) and \
+       not value.dtype.hasobject:
+        return {TYPE_KEY: "numpy", "dtype": value.dtype.str,
+                "value": value.item()}
+
+    return {TYPE_KEY: "pickle",
+            "data": base64.b64encode(pickle.dumps(
+                value, protocol=pickle.HIGHEST_PROTOCOL)).decode("ascii")}
+
+def decode_value(value):
+    if isinstance(value, list):
+        return [decode_value(item) for item in value]
+    elif not isinstance(value, dict):
+        return value
+
+    tag = value.get(TYPE_KEY)
+
+    if tag is None:
+        return {key: decode_value(item) for key, item in value.items()}
+    elif tag == "tuple":
+        return tuple(decode_value(item) for item in value['items'])
+    elif tag == "dict":
+        return {decode_value(key): decode_value(item)
+                for key, item in value['items']}
+    elif tag == "numpy":
+        import numpy as np
+
+        return np.dtype(value['dtype']).type(value['value'])
+    elif tag == "pickle":
+        return pickle.loads(base64.b64decode(value['data']))
+
+    raise ValueError("Unknown encoded type '{}'".format(tag))
+
+def is_header(data):
+    return isinstance(data, dict) and HEADER_KEY in data
+
+class LazyResults(Mapping):
+    """Experiment results, loaded from the results file on first access.
+
+    The result names are known from the header, so iterating over the
+    names does not touch the results file.
+    """
+
+    def __init__(self, filename, names):
+        self.filename = filename
+        self.names = names
+        self.arrays = None
+
+    def _load(self):
+        if self.arrays is None:
+            self.arrays = read_results(self.filename)
+
+        return self.arrays
+
+    def __getitem__(self, name):
+        if name not in self.names:
+            raise KeyError(name)
+
+        return self._load()[name]
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+def save_experiment(filename, data):
+    results = data['results']
+    header = {HEADER_KEY: HEADER_VERSION,
+              "config": encode_value(data['config']),
+              "metadata": encode_value(data['metadata']),
+              "results": sorted(results)}
+
+    mkdirp(get_results_path())
+
+    # Stored as given, numpy arrays are written out-of-band and any
+    # other values, e.g. ragged lists of labels, are pickled.
+    write_results(get_results_filename(filename),
+                  {name: dict(result) for name, result in results.items()})
+
+    # The header is written last, as its presence marks the experiment
+    # as complete.
+    with open(filename, "w") as fd:
+        json.dump(header, fd)
+
+def load_experiment(filename):
+    """Load an experiment, either a header with lazily loaded results or
+    an old style single pickle."""
+    if filename.endswith(".pkl"):
+        with open(filename, "rb") as fd:
+            return pickle.load(fd)
+
+    with open(filename) as fd:
+        header = json.load(fd)
+
+    return {"config": decode_value(header['config']),
+            "metadata": decode_value(header['metadata']),
+            "results": LazyResults(get_results_filename(filename),
+                                   header['results'])}
+
+def remove_experiment_files(filename):
+    os.remove(filename)
+
+    # Old style experiments have no results file
+    results = get_results_filename(filename)
+
+    if os.path.exists(results):
+        os.remove(results)
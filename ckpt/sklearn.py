@@ -17,6 +17,12 @@ class SKPipe(Pipe):
     def fit(self, X, y):
         self.sk_obj.fit(X, y)
 
+    def partial_fit(self, X, y, **kwargs):
+        if not has_method(self.sk_obj, "partial_fit"):
+            return super().partial_fit(X, y, **kwargs)
+
+        self.sk_obj.partial_fit(X, y, **kwargs)
+
     def get_params(self, show_defaults=False):
         defaults = self._get_defaults()
         params = self.sk_obj.get_params()
@@ -27,17 +33,32 @@ class SKPipe(Pipe):
     def get_name(self):
         return self.sk_obj.__class__.__name__
 
+    def get_model(self):
+        return self.sk_obj
+
+    def set_model(self, model):
+        self.sk_obj = model
+
     def _model_filename(self):
-        return "{}.model.xz".format(self.get_name())
+        return "{}.model".format(self.get_name())
 
     def load_model(self, ckpt):
-        for filename in ckpt.listdir():
-            if "model" in filename:
-                self.sk_obj = joblib.load(filename)
-                break
+        try:
+            with ckpt.open_file(self._model_filename(), "rb") as fd:
+                self.sk_obj = joblib.load(fd)
+        except FileNotFoundError:
+            if ckpt.get_manifest() is not None:
+                raise
+
+            # Models saved before the codec was recorded in the suffix
+            for filename in ckpt.listdir():
+                if "model" in filename:
+                    self.sk_obj = joblib.load(filename)
+                    break
 
     def save_model(self, ckpt):
-        joblib.dump(self.sk_obj, ckpt.join_path(self._model_filename()))
+        with ckpt.open_file(self._model_filename(), "wb") as fd:
+            joblib.dump(self.sk_obj, fd)
 
 class SKTransformer(SKPipe, Transformer):
     def transform(self, X, y=None):
@@ -45,15 +66,6 @@ class SKTransformer(SKPipe, Transformer):
 
         return X, y
 
-    def _values_filename(self):
-        return "{}.values.pkl".format(self.get_name())
-
-    def save_values(self, ckpt, X, y):
-        joblib.dump((X, y), ckpt.join_path(self._values_filename()))
-
-    def load_values(self, ckpt):
-        return joblib.load(ckpt.join_path(self._values_filename()))
-
 class SKPredictor(SKPipe, Predictor):
     def predict(self, X):
         return self.sk_obj.predict(X)
@@ -0,0 +1,174 @@
+"""A local cache tier in front of the checkpoint store.
+
+When the ckpt path is on a shared filesystem, every read of a
+checkpoint goes over the network. With a local cache enabled,
+checkpoints are copied to local disk the first time they are read, and
+read from there afterwards. A cached copy is only used while its
+manifest matches the one in the shared store.
+
+New checkpoints are staged on local disk and copied to the shared store
+when they are published, which together with `enable_async_writes`
+happens in the background. The local copy is kept in the cache.
+
+Copies are evicted regardless of whether they are being read, by this
+or other processes. Checkpoints copy the checkpoint again when their
+local copy is gone, see `Checkpoint.get_read_path`.
+"""
+import os
+import os.path
+import shutil
+import logging
+import tempfile
+
+from .misc import mkdirp, parse_size
+from .store import get_dir_size
+from .manifest import load_manifest, write_manifest, forget_manifest
+
+class LocalCache(object):
+    """Copies of published checkpoints, evicted least recently used
+    first once they take up more than `max_size`."""
+
+    def __init__(self, path, max_size="10G"):
+        self.path = path
+        self.max_size = parse_size(max_size)
+        self.logger = logging.getLogger("ckpt.storage")
+
+    def get_entry_path(self, ckpt_hash):
+        return os.path.join(self.path, ckpt_hash)
+
+    def get_staging_path(self, ckpt_hash):
+        mkdirp(self.path)
+
+        return tempfile.mkdtemp(prefix=".{}.".format(ckpt_hash),
+                                dir=self.path)
+
+    def get_entries(self):
+        try:
+            filenames = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+
+        return [filename for filename in filenames
+                if not filename.startswith(".")]
+
+    def is_valid(self, ckpt_hash, manifest):
+        cached = load_manifest(self.get_entry_path(ckpt_hash), refresh=True)
+
+        return cached is not None and cached['files'] == manifest['files']
+
+    def get(self, ckpt_hash, source, manifest):
+        """Path of the cached copy of the checkpoint published in
+        `source`, copying it first if it is missing or out of date.
+        None if it can't be cached."""
+        path = self.get_entry_path(ckpt_hash)
+
+        if self.is_valid(ckpt_hash, manifest):
+            # Access time for the eviction order
+            os.utime(path)
+            return path
+
+        self.remove(ckpt_hash)
+
+        size = sum(item['size'] for item in manifest['files'].values())
+
+        if size > self.max_size:
+            return None
+
+        staging = self.get_staging_path(ckpt_hash)
+
+        try:
+            for filename in manifest['files']:
+                target = os.path.join(staging, filename)
+
+                mkdirp(os.path.dirname(target))
+                shutil.copyfile(os.path.join(source, filename), target)
+        except OSError as err:
+            self.logger.warning("Failed to cache checkpoint {}: {}"
+                                .format(ckpt_hash, err))
+            shutil.rmtree(staging, ignore_errors=True)
+            return None
+
+        self.add(ckpt_hash, staging, manifest)
+
+        return path
+
+    def add(self, ckpt_hash, staging, manifest):
+        """Move a staging directory holding the files of a published
+        checkpoint into the cache."""
+        write_manifest(staging, manifest)
+
+        try:
+            os.rename(staging, self.get_entry_path(ckpt_hash))
+        except OSError:
+            # Cached by another process in the meantime
+            shutil.rmtree(staging, ignore_errors=True)
+
+        self.evict(keep=ckpt_hash)
+
+    def remove(self, ckpt_hash):
+        path = self.get_entry_path(ckpt_hash)
+        forget_manifest(path)
+
+        if not os.path.isdir(path):
+            return
+
+        # Renamed out of the way first, so no one finds it half removed
+        try:
+            trash = tempfile.mkdtemp(prefix=".removed.", dir=self.path)
+            os.rename(path, os.path.join(trash, ckpt_hash))
+        except OSError:
+            return
+
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def get_size(self):
+        return sum(get_dir_size(self.get_entry_path(ckpt_hash))
+                   for ckpt_hash in self.get_entries())
+
+    def evict(self, keep=None):
+        entries = []
+
+        for ckpt_hash in self.get_entries():
+            path = self.get_entry_path(ckpt_hash)
+
+            try:
+                entries.append((os.stat(path).st_mtime, ckpt_hash,
+                                get_dir_size(path)))
+            except FileNotFoundError:
+                pass
+
+        size = sum(entry[2] for entry in entries)
+
+        for _, ckpt_hash, entry_size in sorted(entries):
+            if size <= self.max_size:
+                break
+
+            if ckpt_hash == keep:
+                continue
+
+            self.logger.debug("Evicted {} from local cache".format(ckpt_hash))
+            self.remove(ckpt_hash)
+            size -= entry_size
+
+    def clear(self):
+        for ckpt_hash in self.get_entries():
+            self.remove(ckpt_hash)
+
+local_cache = None
+
+def enable_local_cache(path, max_size="10G"):
+    """Cache checkpoints read from the store in `path`, which should be
+    on local disk, using at most `max_size` bytes."""
+    global local_cache
+
+    local_cache = LocalCache(path, max_size)
+
+    return local_cache
+
+def disable_local_cache():
+    global local_cache
+
+    local_cache = None
+
+def get_local_cache():
+    return local_cache
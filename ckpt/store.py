@@ -0,0 +1,299 @@
+import os
+import os.path
+import time
+import atexit
+import shutil
+import sqlite3
+import logging
+import threading
+
+from .misc import get_ckpt_path, parse_size
+from .lock import FileLock
+from .blobs import walk_files, sweep_blobs, disk_usage
+from .manifest import forget_manifest
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    hash TEXT PRIMARY KEY,
+    name TEXT,
+    size INTEGER NOT NULL,
+    created REAL,
+    last_access REAL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    cost REAL
+);
+"""
+
+POLICIES = ("lru", "lfu", "cost")
+
+# Hits are written once this many checkpoints have pending hits, or
+# this many seconds after the last write.
+HIT_BATCH = 100
+HIT_INTERVAL = 30
+
+def get_dir_size(path):
+    return sum(os.stat(filename).st_size
+               for filename in walk_files(path, data_only=True))
+
+def get_budget():
+    from .config import get_config
+
+    budget = get_config().get("checkpoints", {}).get("budget")
+
+    return parse_size(budget) if budget is not None else None
+
+def sort_key(policy):
+    if policy == "lru":
+        return lambda entry: entry['last_access']
+    elif policy == "lfu":
+        return lambda entry: (entry['hits'], entry['last_access'])
+    elif policy == "cost":
+        # Evict what is cheapest to recompute per byte first, so
+        # expensive fits stay cached.
+        return lambda entry: ((entry['cost'] or 0) / max(entry['size'], 1),
+                              entry['last_access'])
+    else:
+        raise ValueError("Unknown eviction policy '{}', available: {}"
+                         .format(policy, ", ".join(POLICIES)))
+
+class CheckpointStore(object):
+    """Size and access accounting for the checkpoints in the ckpt path.
+
+    Checkpoints record their size and compute time when published, and
+    their last access and hit count when loaded. `gc` uses this to
+    evict checkpoints until the store fits in a budget.
+
+    The database lives in the ckpt path, which may be on a network
+    filesystem shared between hosts, so it uses SQLite's default
+    rollback journal rather than WAL, and hits are written in batches.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_ckpt_path()
+        self.logger = logging.getLogger("ckpt.store")
+        self.db = sqlite3.connect(os.path.join(self.path,
+                                               "checkpoints.sqlite"),
+                                  timeout=60)
+        self.db.executescript(SCHEMA)
+        self.hits = {}
+        self.hits_written = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_details):
+        self.close()
+
+    def close(self):
+        try:
+            self.write_hits()
+        finally:
+            self.db.close()
+
+    def get_checkpoints_path(self):
+        return os.path.join(self.path, "checkpoints")
+
+    def record_save(self, ckpt_hash, name, size, cost):
+        now = time.time()
+
+        with self.db:
+            self.db.execute("INSERT INTO checkpoints "
+                            "VALUES (?, ?, ?, ?, ?, 0, ?) "
+                            "ON CONFLICT(hash) DO UPDATE SET "
+                            "size = size + excluded.size, "
+                            "last_access = excluded.last_access",
+                            (ckpt_hash, name, size, now, now, cost))
+
+    def record_hit(self, ckpt_hash):
+        count, _ = self.hits.get(ckpt_hash, (0, None))
+        self.hits[ckpt_hash] = (count + 1, time.time())
+
+        if len(self.hits) >= HIT_BATCH or \
+           time.time() - self.hits_written > HIT_INTERVAL:
+            self.write_hits()
+
+    def write_hits(self):
+        """Write pending hits. Best effort: hits that can't be written,
+        e.g. as the database is busy, are dropped."""
+        hits, self.hits = self.hits, {}
+        self.hits_written = time.time()
+
+        if not hits:
+            return
+
+        try:
+            with self.db:
+                self.db.executemany("UPDATE checkpoints "
+                                    "SET hits = hits + ?, "
+                                    "last_access = MAX(last_access, ?) "
+                                    "WHERE hash = ?",
+                                    ((count, last_access, ckpt_hash)
+                                     for ckpt_hash, (count, last_access)
+                                     in hits.items()))
+        except sqlite3.Error as err:
+            self.logger.warning("Failed to record checkpoint hits: {}"
+                                .format(err))
+
+    def get_entries(self):
+        self.write_hits()
+
+        columns = ("hash", "name", "size", "created", "last_access", "hits",
+                   "cost")
+
+        return [dict(zip(columns, row)) for row in
+                self.db.execute("SELECT {} FROM checkpoints"
+                                .format(", ".join(columns)))]
+
+    def sync(self):
+        """Account for checkpoints on disk that were never recorded,
+        and forget those that are gone."""
+        path = self.get_checkpoints_path()
+
+        if not os.path.isdir(path):
+            return
+
+        on_disk = set(filename for filename in os.listdir(path)
+                      if not filename.startswith(".")
+                      and os.path.isdir(os.path.join(path, filename)))
+        recorded = set(entry['hash'] for entry in self.get_entries())
+
+        with self.db:
+            for ckpt_hash in recorded - on_disk:
+                self.db.execute("DELETE FROM checkpoints WHERE hash = ?",
+                                (ckpt_hash,))
+
+            for ckpt_hash in on_disk - recorded:
+                ckpt_path = os.path.join(path, ckpt_hash)
+                mtime = os.stat(ckpt_path).st_mtime
+
+                self.db.execute("INSERT INTO checkpoints "
+                                "VALUES (?, NULL, ?, ?, ?, 0, NULL)",
+                                (ckpt_hash, get_dir_size(ckpt_path),
+                                 mtime, mtime))
+
+    def get_size(self):
+        size, = self.db.execute("SELECT COALESCE(SUM(size), 0) "
+                                "FROM checkpoints").fetchone()
+
+        return size
+
+    def get_freed_size(self, ckpt_hash, links):
+        """Bytes freed on disk by evicting a checkpoint.
+
+        Files shared through blobs are only freed with their last
+        checkpoint. `links` counts the remaining links of the files
+        seen so far, and is updated as if the checkpoint was evicted.
+        """
+        size = 0
+
+        for filename in walk_files(os.path.join(self.get_checkpoints_path(),
+                                                ckpt_hash), data_only=True):
+            st = os.stat(filename)
+            # The blob itself is removed once nothing else links to it
+            last = 1 if st.st_nlink > 1 else 0
+
+            links[st.st_ino] = links.get(st.st_ino, st.st_nlink) - 1
+
+            if links[st.st_ino] == last:
+                size += st.st_size
+
+        return size
+
+    def select_evictions(self, budget, policy="lru"):
+        entries = sorted(self.get_entries(), key=sort_key(policy))
+        usage = disk_usage()
+        # Unreferenced blobs are swept anyway
+        size = usage['physical'] - usage['unreferenced_size']
+        links = {}
+        evict = []
+
+        for entry in entries:
+            if size <= budget:
+                break
+
+            evict.append(entry)
+            size -= self.get_freed_size(entry['hash'], links)
+
+        return evict
+
+    def evict(self, ckpt_hash):
+        path = os.path.join(self.get_checkpoints_path(), ckpt_hash)
+        lock = FileLock(path + ".lock")
+
+        # Skip checkpoints that are being written
+        if not lock.acquire(blocking=False):
+            return False
+
+        try:
+            # Renamed first, so readers never see a partly deleted
+            # checkpoint.
+            trash = os.path.join(self.get_checkpoints_path(),
+                                 ".{}.evicted".format(ckpt_hash))
+            os.rename(path, trash)
+            forget_manifest(path)
+            shutil.rmtree(trash)
+
+            with self.db:
+                self.db.execute("DELETE FROM checkpoints WHERE hash = ?",
+                                (ckpt_hash,))
+        finally:
+            lock.release()
+
+        return True
+
+    def gc(self, budget=None, policy="lru", dry_run=False):
+        """Evict checkpoints until the store fits in `budget` bytes.
+
+        Returns the entries evicted, or that would be with `dry_run`.
+        """
+        if budget is None:
+            budget = get_budget()
+
+        if budget is None:
+            raise ValueError("No checkpoint budget given or set in config")
+
+        # Hits recorded in this process count
+        write_pending_hits()
+        self.sync()
+        evict = self.select_evictions(budget, policy)
+
+        if dry_run:
+            return evict
+
+        evicted = []
+
+        for entry in evict:
+            self.logger.info("Evicting checkpoint {} ({} bytes)"
+                             .format(entry['hash'], entry['size']))
+
+            if self.evict(entry['hash']):
+                evicted.append(entry)
+
+        count, size = sweep_blobs()
+
+        if count:
+            self.logger.info("Removed {} unreferenced blobs ({} bytes)"
+                             .format(count, size))
+
+        return evicted
+
+stores = {}
+
+@atexit.register
+def write_pending_hits():
+    """Write the pending hits of this thread's stores."""
+    for (path, pid, thread), store in stores.items():
+        # Connections can only be used by the thread that opened them
+        if pid == os.getpid() and thread == threading.get_ident() \
+           and os.path.isdir(path):
+            store.write_hits()
+
+def get_store():
+    """Store for the current ckpt path, cached per process and thread,
+    as SQLite connections can't be shared between them."""
+    key = (get_ckpt_path(), os.getpid(), threading.get_ident())
+
+    if key not in stores:
+        stores[key] = CheckpointStore()
+
+    return stores[key]
@@ -0,0 +1,280 @@
+import json
+import time
+import logging
+import itertools
+import traceback
+import multiprocessing
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from .pipeline import (Pipeline, load_config, get_use_checkpoints,
+                       set_use_checkpoints)
+
+logger = logging.getLogger("ckpt.sweep")
+
+def expand_grid(grid):
+    """Expand a grid of pipeline configs.
+
+    `grid` maps pipe labels to params, where each param is a list of
+    values to try. Yields every combination as a pipeline config.
+    """
+    keys = [(label, param) for label, params in grid.items()
+            for param in params]
+    values = [grid[label][param] for label, param in keys]
+
+    for combination in itertools.product(*values):
+        config = OrderedDict((label, {}) for label in grid)
+
+        for (label, param), value in zip(keys, combination):
+            config[label][param] = value
+
+        yield config
+
+def load_sweep(filename):
+    """Load pipeline configs from a file.
+
+    The file holds either a single pipeline config, a list of them, or
+    `{"grid": ...}` to be expanded by `expand_grid`.
+    """
+    data = load_config(filename)
+
+    if isinstance(data, list):
+        return [OrderedDict(config) for config in data]
+    elif "grid" in data:
+        return list(expand_grid(data['grid']))
+    else:
+        return [data]
+
+class Node(object):
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.children = OrderedDict()
+        self.configs = []
+
+    def get_config(self):
+        return OrderedDict((label, dict(params))
+                           for label, params in self.prefix)
+
+    def walk(self):
+        yield self
+
+        for child in self.children.values():
+            yield from child.walk()
+
+def build_tree(configs):
+    """Organise configs as a prefix tree over (label, params) stages.
+
+    Every node is a pipeline prefix, and the configs that are exactly
+    that prefix are listed in the node's `configs`.
+    """
+    root = Node(())
+
+    for config in configs:
+        node = root
+
+        for label, params in config.items():
+            key = (label, json.dumps(params, sort_keys=True, default=str))
+
+            if key not in node.children:
+                node.children[key] = Node(node.prefix
+                                          + ((label, params),))
+
+            node = node.children[key]
+
+        node.configs.append(config)
+
+    return root
+
+worker_state = {}
+
+def _init_worker(pipes, load_data, run):
+    worker_state.update(pipes=pipes, load_data=load_data, run=run, data=None)
+
+def _get_data():
+    if worker_state['data'] is None:
+        worker_state['data'] = worker_state['load_data']()
+
+    return worker_state['data']
+
+def _run_node(prefix, configs):
+    """Fit the pipeline `prefix` if no configs end there, otherwise run
+    each of the configs. Returns a list of (config, error) pairs for
+    the configs that failed."""
+    try:
+        if not configs:
+            X, y = _get_data()
+            Pipeline.from_dict(prefix, worker_state['pipes']).fit(X, y)
+
+            return []
+    except Exception:
+        return [(prefix, traceback.format_exc())]
+
+    failures = []
+
+    for config in configs:
+        try:
+            worker_state['run'](config)
+        except Exception:
+            failures.append((config, traceback.format_exc()))
+
+    return failures
+
+def get_jobs(node):
+    """Nodes to run before scheduling the node's dependants.
+
+    A stage shared by several dependants is fitted once by its own job.
+    A stage with a single dependant is left to that dependant, as it
+    would only be fitted once anyway.
+    """
+    for child in node.children.values():
+        if child.configs or len(child.children) > 1:
+            yield child
+        else:
+            yield from get_jobs(child)
+
+class Progress(object):
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.start = time.time()
+
+    def update(self, node, failures):
+        self.done += len(node.configs)
+        elapsed = time.time() - self.start
+
+        # A failed shared stage is counted by `skip`, as failures of the
+        # configs depending on it
+        if node.configs:
+            self.failed += len(failures)
+
+        for config, error in failures:
+            logger.error("{} failed: {}\n{}".format(
+                "Config" if node.configs else "Stage",
+                json.dumps(config), error))
+
+        if node.configs:
+            logger.info("[{}/{}] {} done, {} failed, {:.2f} configs/min"
+                        .format(self.done, self.total,
+                                "+".join(label for label, _ in node.prefix),
+                                self.failed,
+                                60 * self.done / elapsed if elapsed else 0))
+
+def skip(node, progress, error):
+    failures = [(config, error) for child in node.children.values()
+                for n in child.walk() for config in n.configs]
+
+    progress.done += len(failures)
+    progress.failed += len(failures)
+
+    return failures
+
+def build_flat_tree(configs):
+    """A tree with a node for every config, so no stage is fitted on
+    its own."""
+    root = Node(())
+
+    for i, config in enumerate(configs):
+        node = Node(tuple(config.items()))
+        node.configs.append(config)
+        root.children[i] = node
+
+    return root
+
+def run_sweep(configs, pipes, load_data, run, jobs=1, use_checkpoints=True):
+    """Run a sweep of pipeline configs.
+
+    `pipes` maps labels to pipe classes as for `Pipeline.from_dict`,
+    `load_data` returns the training data `(X, y)` and `run(config)`
+    runs the experiment for one config. Stages shared by several
+    configs are fitted once and checkpointed before the configs that
+    depend on them are scheduled, on a pool of `jobs` processes.
+
+    Without `use_checkpoints`, pipelines are fitted without checkpoints,
+    see `set_use_checkpoints`, and every config is fitted on its own.
+
+    Returns a list of (config, error) pairs for failed configs.
+    """
+    enabled = get_use_checkpoints()
+
+    set_use_checkpoints(enabled and use_checkpoints)
+
+    try:
+        return _run_sweep(configs, pipes, load_data, run, jobs)
+    finally:
+        set_use_checkpoints(enabled)
+
+def _run_sweep(configs, pipes, load_data, run, jobs):
+    if get_use_checkpoints():
+        root = build_tree(configs)
+    else:
+        root = build_flat_tree(configs)
+
+    progress = Progress(len(configs))
+    failures = []
+
+    logger.info("Running {} configs with {} jobs".format(len(configs), jobs))
+
+    if jobs == 1:
+        _init_worker(pipes, load_data, run)
+        pending = list(get_jobs(root))
+
+        while pending:
+            node = pending.pop(0)
+            node_failures = _run_node(node.get_config(), node.configs)
+
+            progress.update(node, node_failures)
+
+            if node_failures and not node.configs:
+                failures.extend(skip(node, progress, node_failures[0][1]))
+            else:
+                failures.extend(node_failures)
+                pending[:0] = get_jobs(node)
+
+        return failures
+
+    # Forked workers inherit the functions, so they need not be
+    # picklable.
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=context,
+                             initializer=_init_worker,
+                             initargs=(pipes, load_data, run)) as executor:
+        def submit(node):
+            running[executor.submit(_run_node, node.get_config(),
+                                    node.configs)] = node
+
+        running = {}
+
+        for node in get_jobs(root):
+            submit(node)
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                node = running.pop(future)
+
+                try:
+                    node_failures = future.result()
+                except Exception:
+                    node_failures = [(node.get_config(),
+                                      traceback.format_exc())]
+
+                progress.update(node, node_failures)
+
+                if node_failures and not node.configs:
+                    failures.extend(skip(node, progress,
+                                         node_failures[0][1]))
+                    continue
+
+                failures.extend(node_failures)
+
+                for child in get_jobs(node):
+                    submit(child)
+
+    return failures
@@ -0,0 +1,350 @@
+from unittest import TestCase
+from tempfile import mkdtemp
+
+import os
+import time
+import shutil
+import socket
+import threading
+
+import numpy as np
+import scipy.sparse
+
+from ckpt.checkpoint import Checkpoint
+from ckpt.misc import set_ckpt_path
+from ckpt.codecs import get_codecs
+from ckpt.lock import FileLock, LockTimeout
+from ckpt.store import CheckpointStore
+from ckpt.blobs import disk_usage
+from ckpt.manifest import load_manifest, save_manifest, forget_manifest
+from ckpt.storage import enable_local_cache, disable_local_cache
+
+class TestCheckpoint(TestCase):
+    def setUp(self):
+        self.path = mkdtemp()
+        set_ckpt_path(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_arrays(self):
+        X = np.random.random_sample((20, 5))
+        S = scipy.sparse.random(20, 5, density=0.2, format="csr")
+
+        with Checkpoint("test", []) as ckpt:
+            self.assertFalse(ckpt.has_array("X"))
+
+            ckpt.save_array("X", X)
+            ckpt.save_array("S", S)
+
+        with Checkpoint("test", []) as ckpt:
+            self.assertTrue(ckpt.has_array("X"))
+            self.assertTrue(ckpt.has_array("S"))
+
+            loaded = ckpt.load_array("X")
+            self.assertIsInstance(loaded, np.memmap)
+            np.testing.assert_array_equal(loaded, X)
+
+            loaded = ckpt.load_array("S")
+            self.assertEqual(loaded.format, "csr")
+            np.testing.assert_array_equal(loaded.toarray(), S.toarray())
+
+    def test_codecs(self):
+        for codec in get_codecs():
+            with Checkpoint("test", [codec], codec=codec) as ckpt:
+                with ckpt.open_file("data", "w") as fd:
+                    fd.write(codec)
+
+            # Codec is detected on load
+            with Checkpoint("test", [codec]) as ckpt:
+                with ckpt.open_file("data") as fd:
+                    self.assertEqual(fd.read(), codec)
+
+    def test_publish(self):
+        with Checkpoint("test", []) as ckpt:
+            with ckpt.open_file("data", "w") as fd:
+                fd.write("data")
+
+            # Not visible to others until published
+            self.assertFalse(Checkpoint("test", []).exists())
+
+            with ckpt.open_file("data") as fd:
+                self.assertEqual(fd.read(), "data")
+
+        self.assertTrue(Checkpoint("test", []).exists())
+
+        with self.assertRaises(ValueError):
+            with Checkpoint("failed", []) as ckpt:
+                with ckpt.open_file("data", "w") as fd:
+                    fd.write("data")
+
+                raise ValueError()
+
+        self.assertFalse(Checkpoint("failed", []).exists())
+        self.assertEqual(sorted(os.listdir(os.path.join(self.path,
+                                                        "checkpoints"))),
+                         [Checkpoint("test", []).get_hash()])
+
+    def test_compute_once(self):
+        computed = []
+
+        def compute():
+            with Checkpoint("test", [], quiet=True) as ckpt:
+                if not ckpt.exists():
+                    time.sleep(0.2)
+                    computed.append(1)
+
+                    with ckpt.open_file("data", "w") as fd:
+                        fd.write("data")
+
+        threads = [threading.Thread(target=compute) for _ in range(3)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(computed), 1)
+
+    def test_stale_lock(self):
+        lock_path = os.path.join(self.path, "lock")
+
+        with open(lock_path, "w") as fd:
+            fd.write("{} {}".format(socket.gethostname(), 2**22 + 1))
+
+        lock = FileLock(lock_path, timeout=1)
+        self.assertTrue(lock.acquire())
+        lock.release()
+
+        with FileLock(lock_path):
+            with self.assertRaises(LockTimeout):
+                FileLock(lock_path, timeout=0.2).acquire()
+
+    def test_break_lock(self):
+        lock_path = os.path.join(self.path, "lock")
+        stale = "{} {}".format(socket.gethostname(), 2**22 + 1)
+
+        with open(lock_path, "w") as fd:
+            fd.write(stale)
+
+        # Another waiter breaks the stale lock and takes it before this
+        # one gets to
+        waiter = FileLock(lock_path)
+        self.assertTrue(waiter.is_stale(stale))
+
+        holder = FileLock(lock_path)
+        self.assertTrue(holder.acquire())
+
+        self.assertFalse(waiter._remove(stale))
+        self.assertFalse(waiter.acquire(blocking=False))
+
+        # A holder whose lock was broken leaves the new owner's alone
+        os.remove(lock_path)
+        owner = FileLock(lock_path)
+        self.assertTrue(owner.acquire())
+
+        holder.release()
+        self.assertTrue(os.path.exists(lock_path))
+
+        owner.release()
+        self.assertFalse(os.path.exists(lock_path))
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_gc(self):
+        for name in ("a", "b", "c"):
+            with Checkpoint(name, [], quiet=True) as ckpt:
+                with ckpt.open_file("data", "w", compression=None) as fd:
+                    fd.write(name * 100)
+
+        # Hit a, making b the least recently used
+        with Checkpoint("a", [], quiet=True):
+            pass
+
+        with CheckpointStore() as store:
+            self.assertEqual(store.get_size(), 300)
+
+            evict = store.gc(200, "lru", dry_run=True)
+            self.assertEqual([entry['name'] for entry in evict], ["b"])
+
+            evict = store.gc(100, "lfu")
+            self.assertEqual([entry['name'] for entry in evict], ["b", "c"])
+            self.assertEqual(store.get_size(), 100)
+
+        self.assertTrue(Checkpoint("a", []).exists())
+        self.assertFalse(Checkpoint("b", []).exists())
+
+    def test_blobs(self):
+        for name in ("a", "b"):
+            with Checkpoint(name, [], quiet=True) as ckpt:
+                with ckpt.open_file("data", "w", compression=None) as fd:
+                    fd.write("x" * 100)
+
+        a = os.stat(Checkpoint("a", []).find_path("data"))
+        b = os.stat(Checkpoint("b", []).find_path("data"))
+        self.assertEqual(a.st_ino, b.st_ino)
+
+        usage = disk_usage()
+        self.assertEqual(usage['logical'], 200)
+        self.assertEqual(usage['physical'], 100)
+        self.assertEqual(usage['blobs'], 1)
+
+        with CheckpointStore() as store:
+            # Evicting one copy would not free anything
+            evict = store.gc(50, "lru", dry_run=True)
+            self.assertEqual([entry['name'] for entry in evict], ["a", "b"])
+
+            store.gc(50, "lru")
+
+        usage = disk_usage()
+        self.assertEqual(usage['physical'], 0)
+        self.assertEqual(usage['blobs'], 0)
+
+    def test_join_path_published(self):
+        for name in ("a", "b"):
+            with Checkpoint(name, [], quiet=True) as ckpt:
+                with ckpt.open_file("data", "w", compression=None) as fd:
+                    fd.write("x" * 100)
+
+        # The blob is shared, so published files are written through a
+        # copy, and only inside a with-block
+        with self.assertRaises(ValueError):
+            Checkpoint("a", []).join_path("data")
+
+        with Checkpoint("a", [], quiet=True) as ckpt:
+            with open(ckpt.join_path("data"), "a") as fd:
+                fd.write("y")
+
+        with Checkpoint("a", []).open_file("data", compression=None) as fd:
+            self.assertEqual(fd.read(), "x" * 100 + "y")
+
+        with Checkpoint("b", []).open_file("data", compression=None) as fd:
+            self.assertEqual(fd.read(), "x" * 100)
+
+    def test_manifest(self):
+        with Checkpoint("a", [], quiet=True, codec="none") as ckpt:
+            with ckpt.open_file("model", "w") as fd:
+                fd.write("x" * 100)
+
+        manifest = load_manifest(ckpt.get_path())
+        self.assertEqual(manifest['name'], "a")
+        self.assertEqual(manifest['codec'], "none")
+        self.assertEqual(manifest['files']['model']['size'], 100)
+        self.assertEqual(manifest['lineage'], [["a", ckpt.get_hash()]])
+
+        # Files added later are merged into the manifest
+        with Checkpoint("a", [], quiet=True) as ckpt:
+            with ckpt.open_file("values", "w", compression=None) as fd:
+                fd.write("y")
+
+        forget_manifest(ckpt.get_path())
+        ckpt = Checkpoint("a", [])
+        self.assertTrue(ckpt.exists())
+        self.assertEqual(sorted(ckpt.get_manifest()['files']),
+                         ["model", "values"])
+
+        with ckpt.open_file("values") as fd:
+            self.assertEqual(fd.read(), "y")
+
+        # Resolved from the manifest, not the directory
+        os.remove(os.path.join(ckpt.get_path(), "model"))
+        self.assertTrue(ckpt.has_file("model"))
+        self.assertFalse(ckpt.has_file("missing"))
+
+        # Evicted by another process, which can't forget the cached
+        # manifest
+        shutil.rmtree(ckpt.get_path())
+        self.assertFalse(Checkpoint("a", []).exists())
+
+    def test_local_cache(self):
+        local = mkdtemp()
+        cache = enable_local_cache(local, max_size=2500)
+
+        try:
+            # Written to local disk, and published to the shared store
+            with Checkpoint("a", [], quiet=True, codec="none") as ckpt:
+                self.assertTrue(ckpt.get_staging_path().startswith(local))
+                ckpt.save_array("X", np.arange(100))
+
+            shared = ckpt.get_path()
+            self.assertIn("X.npy", load_manifest(shared)['files'])
+            self.assertEqual(cache.get_entries(), [ckpt.get_hash()])
+
+            # Read from the local copy
+            with Checkpoint("a", [], quiet=True) as ckpt:
+                self.assertTrue(ckpt.load_array("X").filename
+                                .startswith(local))
+
+            # Read through, after the local copy is gone
+            cache.clear()
+
+            with Checkpoint("a", [], quiet=True) as ckpt:
+                self.assertEqual(list(ckpt.load_array("X")), list(range(100)))
+                self.assertTrue(ckpt.find_path("X.npy").startswith(local))
+
+            # Out of date copies are fetched again
+            with Checkpoint("a", [], quiet=True) as ckpt:
+                with ckpt.open_file("y", "w", compression=None) as fd:
+                    fd.write("y")
+
+            ckpt = Checkpoint("a", [])
+            self.assertTrue(ckpt.find_path("y").startswith(local))
+
+            with ckpt.open_file("y") as fd:
+                self.assertEqual(fd.read(), "y")
+
+            manifest = load_manifest(shared)
+            manifest['files']['y']['size'] = 2
+            save_manifest(shared, manifest)
+
+            with open(os.path.join(shared, "y"), "w") as fd:
+                fd.write("yy")
+
+            with Checkpoint("a", [], quiet=True).open_file("y") as fd:
+                self.assertEqual(fd.read(), "yy")
+
+            # Least recently used copies are evicted over the budget
+            for name in ("b", "c"):
+                with Checkpoint(name, [], quiet=True) as ckpt:
+                    ckpt.save_array("X", np.arange(100))
+
+                time.sleep(0.01)
+
+            self.assertEqual(sorted(cache.get_entries()),
+                             sorted([Checkpoint("b", []).get_hash(),
+                                     Checkpoint("c", []).get_hash()]))
+            self.assertLessEqual(cache.get_size(), 2500)
+            self.assertTrue(Checkpoint("a", []).exists())
+        finally:
+            disable_local_cache()
+            shutil.rmtree(local)
+
+    def test_local_cache_evicted(self):
+        local = mkdtemp()
+        cache = enable_local_cache(local, max_size=1500)
+
+        try:
+            for name in ("a", "b"):
+                with Checkpoint(name, [], quiet=True) as ckpt:
+                    ckpt.save_array("X", np.arange(100))
+
+            a = Checkpoint("a", [])
+            self.assertTrue(a.get_read_path().startswith(local))
+
+            # Evicts the copy of a
+            Checkpoint("b", []).load_array("X")
+            self.assertEqual(cache.get_entries(),
+                             [Checkpoint("b", []).get_hash()])
+
+            self.assertEqual(list(a.load_array("X")), list(range(100)))
+
+            # Cleared after the path was resolved
+            path = a.find_path("X.npy")
+            cache.clear()
+            self.assertFalse(os.path.exists(path))
+
+            with a.open_file("X.npy", "rb", compression=None) as fd:
+                self.assertTrue(fd.read())
+        finally:
+            disable_local_cache()
+            shutil.rmtree(local)
@@ -0,0 +1,41 @@
+from unittest import TestCase
+
+import numpy as np
+import scipy.sparse
+
+from ckpt.fingerprint import Fingerprint, fingerprint
+
+class TestFingerprint(TestCase):
+    def test_array(self):
+        X = np.arange(100, dtype=np.float64).reshape((10, 10))
+
+        self.assertEqual(fingerprint(X), fingerprint(X.copy()))
+        self.assertNotEqual(fingerprint(X), fingerprint(X.astype(np.float32)))
+        self.assertNotEqual(fingerprint(X), fingerprint(X.reshape((20, 5))))
+
+        X2 = X.copy()
+        X2[5, 5] += 1
+
+        self.assertNotEqual(fingerprint(X), fingerprint(X2))
+
+    def test_chunks(self):
+        X = np.random.random_sample((100, 30))
+
+        for arr in (X, X[:, ::3], X.T):
+            small = Fingerprint(chunk_size=64).update(arr).hexdigest()
+            self.assertEqual(small, fingerprint(arr))
+
+    def test_nested(self):
+        X = np.ones((4, 4))
+
+        self.assertEqual(fingerprint((X, None)), fingerprint((X.copy(), None)))
+        self.assertNotEqual(fingerprint((X, None)), fingerprint([X, None]))
+        self.assertNotEqual(fingerprint((X, None)), fingerprint((X, [1, 2])))
+
+    def test_sparse(self):
+        X = scipy.sparse.random(50, 50, density=0.1, format="csr",
+                                random_state=0)
+
+        self.assertEqual(fingerprint(X), fingerprint(X.copy()))
+        self.assertNotEqual(fingerprint(X), fingerprint(X.tocsc()))
+        self.assertNotEqual(fingerprint(X), fingerprint(X * 2))
@@ -0,0 +1,50 @@
+from unittest import TestCase
+
+import sys
+import subprocess
+
+# Cumulative import time budget for the command line, in microseconds.
+# Generous, as it only has to catch heavy dependencies creeping in.
+IMPORT_BUDGET = 500000
+
+HEAVY_MODULES = ("numpy", "scipy", "pandas", "sklearn", "tabulate")
+
+def get_imports(statement):
+    """Modules imported by `statement`, mapped to their cumulative
+    import time as reported by `python -X importtime`."""
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                             statement],
+                            stderr=subprocess.PIPE, universal_newlines=True,
+                            check=True).stderr
+    imports = {}
+
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line.split("|")
+        imports[name.strip()] = int(cumulative)
+
+    return imports
+
+class TestImports(TestCase):
+    def test_cli(self):
+        imports = get_imports("from ckpt.argparse import Parser; Parser()")
+
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, imports)
+
+        self.assertLess(imports['ckpt.argparse'], IMPORT_BUDGET)
+
+    def test_light_commands(self):
+        # What `remove` and `reindex` import
+        imports = get_imports("import ckpt.report")
+
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, imports)
+
+    def test_no_side_effects(self):
+        subprocess.run([sys.executable, "-c",
+                        "import sys, logging, ckpt, ckpt.experiment; "
+                        "sys.exit(len(logging.getLogger().handlers))"],
+                       check=True)
@@ -0,0 +1,146 @@
+from unittest import TestCase
+from tempfile import mkdtemp
+
+import os
+import sys
+import shutil
+import pickle
+import subprocess
+
+from functools import partial
+
+from ckpt.experiment import Experiment
+from ckpt.index import ExperimentIndex
+from ckpt.misc import (set_ckpt_path, mkdirp, shortest_unique_prefix,
+                       AmbiguousIdError, get_function_hash)
+
+calls = []
+
+def count(y_true, y_pred):
+    calls.append(1)
+    return len(y_true)
+
+def accuracy(y_true, y_pred):
+    return sum(a == b for a, b in zip(y_true, y_pred)) / len(y_true)
+
+class TestIndex(TestCase):
+    def setUp(self):
+        self.path = mkdtemp()
+        set_ckpt_path(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def run_experiment(self, config):
+        with Experiment("test", config) as ex:
+            ex.add_results("dev", [0, 1, 1, 0], [0, 1, 0, 0])
+
+    def test_index(self):
+        self.run_experiment({"a": {"b": 1}})
+        self.run_experiment({"a": {"b": 2}})
+
+        with ExperimentIndex() as index:
+            ex_ids = index.get_ids()
+            self.assertEqual(len(ex_ids), 2)
+
+            data = index.get(ex_ids[0])
+            self.assertIn(data['config']['a']['b'], (1, 2))
+            self.assertEqual(data['results'], ["dev"])
+
+        os.remove(os.path.join(self.path, "index.sqlite"))
+
+        with ExperimentIndex() as index:
+            index.sync({"accuracy": accuracy})
+
+            self.assertEqual(index.get_ids(), ex_ids)
+            self.assertEqual(index.get_metrics(ex_ids[0],
+                                               {"accuracy": accuracy}),
+                             {"dev-accuracy": 0.75})
+
+            os.remove(index.get_filename(ex_ids[0]))
+            index.sync()
+
+            self.assertEqual(index.get_ids(), ex_ids[1:])
+
+    def test_metric_cache(self):
+        self.run_experiment({"a": 1})
+
+        with ExperimentIndex() as index:
+            ex_id, = index.get_ids()
+
+            metrics = {"count": count}
+
+            for _ in range(2):
+                self.assertEqual(index.get_metrics(ex_id, metrics),
+                                 {"dev-count": 4})
+
+            self.assertEqual(len(calls), 1)
+
+            # Changed code invalidates the cached score
+            metrics = {"count": lambda y_true, y_pred: 2 * len(y_true)}
+            self.assertEqual(index.get_metrics(ex_id, metrics),
+                             {"dev-count": 8})
+
+    def test_function_hash(self):
+        def threshold(value):
+            return lambda y_true, y_pred: value
+
+        fn = partial(accuracy, average="macro")
+        output = subprocess.run(
+            [sys.executable, "-c",
+             "from functools import partial; "
+             "from ckpt.misc import get_function_hash; "
+             "from ckpt.tests.test_index import accuracy; "
+             "print(get_function_hash(partial(accuracy, average='macro')))"],
+            stdout=subprocess.PIPE, universal_newlines=True, check=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.dirname(
+                os.path.abspath(__file__))))).stdout
+
+        # The same across processes
+        self.assertEqual(output.strip(), get_function_hash(fn))
+        self.assertNotEqual(get_function_hash(fn),
+                            get_function_hash(partial(accuracy,
+                                                      average="micro")))
+        self.assertEqual(get_function_hash(threshold(1)),
+                         get_function_hash(threshold(1)))
+        self.assertNotEqual(get_function_hash(threshold(1)),
+                            get_function_hash(threshold(2)))
+
+    def test_old_style(self):
+        mkdirp(os.path.join(self.path, "experiments"))
+        filename = os.path.join(self.path, "experiments", "0123abc.pkl")
+
+        with open(filename, "wb") as fd:
+            pickle.dump({"config": {"a": 1},
+                         "metadata": {"name": "old"},
+                         "metrics": {"accuracy": 0.5}}, fd)
+
+        with ExperimentIndex() as index:
+            index.sync()
+
+            self.assertEqual(index.get_ids(), ["0123abc"])
+            self.assertEqual(index.get_metrics("0123abc"), {"accuracy": 0.5})
+
+    def test_resolve(self):
+        mkdirp(os.path.join(self.path, "experiments"))
+
+        with ExperimentIndex() as index:
+            for ex_id in ("abc123", "abd456", "ff0000"):
+                index.add(ex_id + ".pkl", {"config": {}, "metadata": {}})
+
+            self.assertEqual(index.get_prefix_length(), 3)
+            self.assertEqual(index.resolve("abc"), "abc123")
+            self.assertEqual(index.resolve("f"), "ff0000")
+            self.assertIsNone(index.resolve("abe"))
+
+            with self.assertRaises(AmbiguousIdError):
+                index.resolve("ab")
+
+            index.add("abc124.pkl", {"config": {}, "metadata": {}})
+            self.assertEqual(index.get_prefix_length(), 6)
+
+            index.remove("abc124")
+            self.assertEqual(index.get_prefix_length(), 3)
+
+        self.assertEqual(shortest_unique_prefix(["abc123", "abd456",
+                                                 "ff0000"]), 3)
@@ -0,0 +1,415 @@
+from unittest import TestCase
+from tempfile import mkdtemp
+
+import os
+import time
+import shutil
+import pickle
+
+from ckpt.base import Transformer, Predictor
+from ckpt.pipeline import Pipeline
+from ckpt.misc import set_ckpt_path
+from ckpt.cache import ModelCache, enable_model_cache, disable_model_cache
+from ckpt.writer import enable_async_writes, disable_async_writes
+from ckpt.profile import start_profiling, stop_profiling, summarize
+
+calls = []
+
+class Scale(Transformer):
+    def __init__(self, factor=1):
+        self.factor = factor
+
+    def fit(self, X, y):
+        calls.append(("fit", self.get_name()))
+        self.fitted = self.factor
+
+    def transform(self, X, y=None):
+        calls.append(("transform", self.get_name()))
+        return [x * self.fitted for x in X], y
+
+    def load_model(self, ckpt):
+        with ckpt.open_file("model", "rb") as fd:
+            self.fitted = pickle.load(fd)
+
+    def save_model(self, ckpt):
+        with ckpt.open_file("model", "wb") as fd:
+            pickle.dump(self.fitted, fd)
+
+class Shift(Scale):
+    pass
+
+class Broken(Scale):
+    def save_model(self, ckpt):
+        with ckpt.open_file("model", "wb") as fd:
+            fd.write(b"partial")
+
+        raise IOError("disk full")
+
+class Mean(Predictor):
+    def __init__(self, offset=0):
+        self.offset = offset
+
+    def fit(self, X, y):
+        calls.append(("fit", self.get_name()))
+        self.mean = sum(X) / len(X)
+
+    def predict(self, X):
+        return [self.mean + self.offset for _ in X]
+
+    def load_model(self, ckpt):
+        with ckpt.open_file("model", "rb") as fd:
+            self.mean = pickle.load(fd)
+
+    def save_model(self, ckpt):
+        with ckpt.open_file("model", "wb") as fd:
+            pickle.dump(self.mean, fd)
+
+class IncrementalScale(Scale):
+    def partial_fit(self, X, y):
+        calls.append(("partial_fit", self.get_name()))
+        self.fitted = self.factor
+
+class IncrementalMean(Mean):
+    def partial_fit(self, X, y):
+        calls.append(("partial_fit", self.get_name()))
+        total, count = getattr(self, "totals", (0, 0))
+        self.totals = (total + sum(X), count + len(X))
+        self.mean = self.totals[0] / self.totals[1]
+
+class Estimator(Mean):
+    """Refitted in place, like scikit-learn estimators."""
+
+    def __init__(self, offset=0):
+        super().__init__(offset)
+        self.state = {}
+
+    def fit(self, X, y):
+        calls.append(("fit", self.get_name()))
+        self.state['mean'] = sum(X) / len(X)
+
+    def predict(self, X):
+        return [self.state['mean'] for _ in X]
+
+    def get_model(self):
+        return self.state
+
+    def set_model(self, model):
+        self.state = model
+
+    def load_model(self, ckpt):
+        with ckpt.open_file("model", "rb") as fd:
+            self.state = pickle.load(fd)
+
+    def save_model(self, ckpt):
+        with ckpt.open_file("model", "wb") as fd:
+            pickle.dump(self.state, fd)
+
+class SlowEstimator(Estimator):
+    def save_model(self, ckpt):
+        time.sleep(0.1)
+        super().save_model(ckpt)
+
+class Tokenize(Transformer):
+    cache_values = True
+
+    def __init__(self, lowercase=False):
+        self.lowercase = lowercase
+
+    def fit(self, X, y):
+        self.fitted = True
+
+    def transform(self, X, y=None):
+        import numpy as np
+
+        tokens = np.empty(len(X), dtype=object)
+        tokens[:] = [text.split() for text in X]
+
+        return tokens, y
+
+    def load_model(self, ckpt):
+        self.fitted = True
+
+    def save_model(self, ckpt):
+        pass
+
+class Count(Mean):
+    def fit(self, X, y):
+        calls.append(("fit", self.get_name()))
+        self.mean = sum(len(tokens) for tokens in X) / len(X)
+
+def make_pipeline(offset=0):
+    return Pipeline([("scale", Scale(factor=2)),
+                     ("shift", Shift(factor=3)),
+                     ("mean", Mean(offset=offset))])
+
+class TestPipeline(TestCase):
+    def setUp(self):
+        self.path = mkdtemp()
+        set_ckpt_path(self.path)
+        del calls[:]
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_lineage(self):
+        X = [1, 2, 3]
+
+        pipeline = make_pipeline()
+        pipeline.fit(X)
+
+        self.assertEqual(len(calls), 5)
+        self.assertEqual(pipeline.predict(X), [12.0] * 3)
+
+        lineage = pipeline.checkpoints[-1].get_lineage()
+        self.assertEqual([h for _, h in lineage],
+                         [h for _, h in pipeline.get_lineage()])
+
+        # Fully cached, nothing is fitted or transformed
+        del calls[:]
+        make_pipeline().fit(X)
+        self.assertEqual(calls, [])
+
+        # Only the final stage differs, upstream data is only
+        # transformed to fit it
+        pipeline = make_pipeline(offset=1)
+        pipeline.fit(X)
+        self.assertEqual(calls, [("transform", "Scale"),
+                                 ("transform", "Shift"),
+                                 ("fit", "Mean")])
+
+        cached = make_pipeline()
+        cached.fit(X)
+        self.assertEqual(pipeline.get_lineage()[:2], cached.get_lineage()[:2])
+        self.assertNotEqual(pipeline.get_lineage()[2],
+                            cached.get_lineage()[2])
+
+    def test_cache_values(self):
+        X = [1, 2, 3]
+
+        Pipeline([("scale", Scale(factor=2)),
+                  ("shift", Shift(factor=3)),
+                  ("mean", Mean())],
+                 cache_values=True).fit(X)
+
+        del calls[:]
+        pipeline = Pipeline([("scale", Scale(factor=2)),
+                             ("shift", Shift(factor=3)),
+                             ("mean", Mean(offset=1))],
+                            cache_values=True)
+        pipeline.fit(X)
+
+        self.assertEqual(calls, [("fit", "Mean")])
+        self.assertEqual(pipeline.predict(X), [13.0] * 3)
+
+    def test_cache_object_values(self):
+        X = ["a b", "c d e"]
+
+        Pipeline([("tokenize", Tokenize()), ("count", Count())]).fit(X)
+
+        del calls[:]
+        pipeline = Pipeline([("tokenize", Tokenize()),
+                             ("count", Count(offset=1))])
+        pipeline.fit(X)
+
+        self.assertEqual(calls, [("fit", "Count")])
+        self.assertEqual(pipeline.predict(["x"]), [3.5])
+
+    def test_model_cache(self):
+        X = [1, 2, 3]
+        cache = enable_model_cache()
+
+        try:
+            make_pipeline().fit(X)
+            self.assertEqual(len(cache), 3)
+
+            # Served from memory, even with the checkpoints gone
+            shutil.rmtree(os.path.join(self.path, "checkpoints"))
+            del calls[:]
+            pipeline = make_pipeline()
+            pipeline.fit(X)
+
+            self.assertEqual(calls, [])
+            self.assertEqual(pipeline.predict(X), [12.0] * 3)
+        finally:
+            disable_model_cache()
+
+    def test_model_cache_eviction(self):
+        cache = ModelCache(2500)
+
+        cache.put("a", bytes(1000))
+        cache.put("b", bytes(1000))
+        cache.get("a")
+        cache.put("c", bytes(1000))
+
+        self.assertEqual(sorted(cache.entries), ["a", "c"])
+        self.assertFalse(cache.put("d", bytes(5000)))
+
+        model = {"w": [1, 2]}
+        cache.put("e", model)
+        self.assertIsNot(cache.get("e"), model)
+        self.assertEqual(cache.get("e"), model)
+
+        # Snapshotted, later changes don't reach the cache
+        model['w'].append(3)
+        self.assertEqual(cache.get("e"), {"w": [1, 2]})
+
+    def test_model_cache_refit(self):
+        cache = enable_model_cache()
+
+        try:
+            estimator = Estimator()
+            estimator._fit([1, 2, 3], None, True)
+            estimator._fit([5, 6, 7], None, True)
+
+            shutil.rmtree(os.path.join(self.path, "checkpoints"))
+            del calls[:]
+            estimator = Estimator()
+            estimator._fit([1, 2, 3], None, True)
+
+            self.assertEqual(calls, [])
+            self.assertEqual(estimator.predict([0]), [2.0])
+        finally:
+            disable_model_cache()
+
+    def test_model_cache_values(self):
+        X = [1, 2, 3]
+
+        def make_cached(offset=0):
+            return Pipeline([("scale", Scale(factor=2)),
+                             ("shift", Shift(factor=3)),
+                             ("mean", Mean(offset=offset))],
+                            cache_values=True)
+
+        enable_model_cache()
+
+        try:
+            make_cached().fit(X)
+
+            # Models served from memory are not on disk, so no values
+            # are saved next to them
+            shutil.rmtree(os.path.join(self.path, "checkpoints"))
+            pipeline = make_cached(offset=1)
+            pipeline.fit(X)
+
+            self.assertFalse(pipeline.checkpoints[0].exists())
+            self.assertFalse(pipeline.checkpoints[1].exists())
+        finally:
+            disable_model_cache()
+
+        del calls[:]
+        pipeline = make_cached(offset=1)
+        pipeline.fit(X)
+
+        # Upstream models are fitted again, the final one is on disk
+        self.assertEqual(calls, [("fit", "Scale"),
+                                 ("transform", "Scale"),
+                                 ("fit", "Shift")])
+        self.assertEqual(pipeline.predict(X), [13.0] * 3)
+
+    def test_async_writes(self):
+        X = [1, 2, 3]
+        writer = enable_async_writes()
+
+        try:
+            pipeline = make_pipeline()
+            pipeline.fit(X)
+            writer.flush()
+
+            self.assertTrue(all(ckpt.exists()
+                                for ckpt in pipeline.checkpoints))
+
+            del calls[:]
+            make_pipeline().fit(X)
+            self.assertEqual(calls, [])
+
+            # Failed saves are raised on the main thread, and leave
+            # nothing behind
+            pipeline = Pipeline([("broken", Broken()), ("mean", Mean())])
+
+            with self.assertRaises(IOError):
+                pipeline.fit(X)
+                writer.flush()
+
+            writer.flush()
+
+            self.assertFalse(pipeline.checkpoints[0].exists())
+            self.assertFalse(os.path.exists(
+                pipeline.checkpoints[0].get_path() + ".lock"))
+        finally:
+            disable_async_writes()
+
+    def test_async_writes_refit(self):
+        writer = enable_async_writes()
+
+        try:
+            # Refitted before the first save runs
+            estimator = SlowEstimator()
+            estimator._fit([1, 2, 3], None, True)
+            estimator._fit([5, 6, 7], None, True)
+            writer.flush()
+
+            estimator = SlowEstimator()
+            estimator._fit([1, 2, 3], None, True)
+
+            self.assertEqual(estimator.predict([0]), [2.0])
+        finally:
+            disable_async_writes()
+
+    def test_profile(self):
+        X = [1, 2, 3]
+
+        start_profiling()
+        make_pipeline().fit(X)
+        make_pipeline().fit(X)
+        records = stop_profiling()
+
+        summary, peak_rss = summarize(records)
+
+        self.assertEqual(summary[("scale+shift+mean", "hash")]['calls'], 2)
+        self.assertEqual(summary[("Scale", "fit")]['calls'], 1)
+        self.assertEqual(summary[("Scale", "load")]['calls'], 1)
+        self.assertEqual(summary[("Scale", "transform")]['calls'], 1)
+        self.assertEqual(summary[("Mean", "save")]['calls'], 1)
+        self.assertGreater(peak_rss, 0)
+        self.assertEqual(stop_profiling(), [])
+
+    def test_predict_chunked(self):
+        X = list(range(1, 11))
+        pipeline = make_pipeline()
+        pipeline.fit(X)
+        expected = pipeline.predict(X)
+
+        self.assertEqual([len(p) for p in pipeline.predict_iter(X, 4)],
+                         [4, 4, 2])
+        self.assertEqual(pipeline.predict_chunked(X, 3), expected)
+        self.assertEqual(pipeline.predict_chunked(X, 3, jobs=2), expected)
+        self.assertEqual(pipeline.predict_chunked(X, 3, jobs=2,
+                                                  executor="process"),
+                         expected)
+
+        # Batches larger than the chunk size are split
+        batches = iter([X[:7], X[7:]])
+        self.assertEqual([len(p) for p in pipeline.predict_iter(batches, 5)],
+                         [5, 2, 3])
+
+    def test_fit_stream(self):
+        X = list(range(1, 11))
+
+        def make_incremental():
+            return Pipeline([("scale", IncrementalScale(factor=2)),
+                             ("mean", IncrementalMean())])
+
+        pipeline = make_incremental()
+        pipeline.fit(X, chunk_size=4)
+
+        self.assertEqual(calls.count(("partial_fit", "IncrementalScale")), 3)
+        self.assertEqual(calls.count(("partial_fit", "IncrementalMean")), 3)
+        self.assertEqual(pipeline.predict([0]), [11.0])
+
+        # Checkpointed under the fingerprint of the stream
+        del calls[:]
+        pipeline = make_incremental()
+        pipeline.fit(lambda: ((X[i:i + 4], None) for i in range(0, 10, 4)))
+
+        self.assertEqual(calls, [])
+        self.assertEqual(pipeline.predict([0]), [11.0])
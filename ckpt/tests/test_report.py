@@ -0,0 +1,108 @@
+from unittest import TestCase
+from tempfile import mkdtemp
+
+import os
+import shutil
+
+from ckpt.experiment import Experiment, add_metric, get_metrics
+from ckpt.index import ExperimentIndex
+from ckpt.misc import set_ckpt_path
+from ckpt.report import (get_experiments, load_experiments, rebuild_index,
+                         top_k, tabulate_data, prune)
+
+calls = []
+
+def count(y_true, y_pred):
+    calls.append(1)
+    return len(y_true)
+
+class TestReport(TestCase):
+    def setUp(self):
+        self.path = mkdtemp()
+        set_ckpt_path(self.path)
+        self.metrics = dict(get_metrics())
+        get_metrics().clear()
+        del calls[:]
+
+    def tearDown(self):
+        get_metrics().clear()
+        get_metrics().update(self.metrics)
+        shutil.rmtree(self.path)
+
+    def run_experiments(self, n):
+        for i in range(n):
+            with Experiment("test", {"a": i}) as ex:
+                ex.add_results("dev", [0] * (i + 1), [0] * (i + 1))
+
+        os.remove(os.path.join(self.path, "index.sqlite"))
+
+    def test_sync_without_metrics(self):
+        self.run_experiments(3)
+        add_metric("count", count)
+
+        # Reading experiments doesn't score them
+        self.assertEqual(len(list(load_experiments())), 3)
+        self.assertEqual(calls, [])
+
+        rows = list(get_experiments(jobs=2))
+
+        self.assertEqual(sorted(row[3]['dev-count'] for row in rows),
+                         [1, 2, 3])
+
+        # Cached in the index
+        del calls[:]
+        list(get_experiments())
+        self.assertEqual(calls, [])
+
+    def test_rebuild_index(self):
+        self.run_experiments(2)
+        add_metric("count", count)
+
+        rebuild_index(jobs=2)
+
+        # Scored while rebuilding
+        with ExperimentIndex() as index:
+            self.assertEqual(sorted(index.get_metrics(ex_id, get_metrics())
+                                    ['dev-count']
+                                    for ex_id in index.get_ids()), [1, 2])
+
+    def rows(self):
+        return [("a1", ["test"], {"k": 1}, {"acc": 0.5}),
+                ("b2", ["test"], {"k": 2}, {}),
+                ("c3", ["test"], {"k": 3}, {"acc": 0.9}),
+                ("d4", ["test"], {"k": 4}, {"acc": 0.1})]
+
+    def test_top_k(self):
+        best = top_k(self.rows(), "acc", 2)
+        self.assertEqual([row[0] for row in best], ["c3", "a1"])
+
+        worst = top_k(self.rows(), "acc", 2, reverse_sort=False)
+        self.assertEqual([row[0] for row in worst], ["d4", "a1"])
+
+        # Rows missing the value sort last in both directions
+        for reverse_sort in (True, False):
+            ranked = top_k(self.rows(), "acc", 4, reverse_sort)
+            self.assertEqual(ranked[-1][0], "b2")
+
+    def test_tabulate_limit(self):
+        for reverse_sort in (True, False):
+            data, headers = tabulate_data(iter(self.rows()), "acc",
+                                          reverse_sort, limit=3)
+            full, _ = tabulate_data(iter(self.rows()), "acc", reverse_sort)
+
+            self.assertEqual(data, full[:3])
+            self.assertEqual(full[-1][0], "b2")
+
+        data, _ = tabulate_data(iter(self.rows()), limit=2)
+        self.assertEqual([row[0] for row in data], ["a1", "b2"])
+
+    def test_prune(self):
+        rows = [("a1", ["test"], {"k": 1, "seed": 0}, {"acc": 0.5}),
+                ("a1", ["test"], {"k": 1, "seed": 1}, {"acc": 0.5}),
+                ("b2", ["test"], {"k": 2, "seed": 0}, {"acc": 0.5})]
+
+        # Only varying keys are shown, and rows that are identical
+        # after that are dropped
+        self.assertEqual(list(prune(rows, {"k"})),
+                         [("a1", ["test"], {"k": 1}, {"acc": 0.5}),
+                          ("b2", ["test"], {"k": 2}, {"acc": 0.5})])
@@ -0,0 +1,109 @@
+from unittest import TestCase
+from tempfile import mkdtemp
+from collections import OrderedDict
+
+import os
+import shutil
+
+from ckpt.experiment import Experiment
+from ckpt.index import ExperimentIndex
+from ckpt.profile import profile
+from ckpt.misc import set_ckpt_path
+
+class TestResults(TestCase):
+    def setUp(self):
+        self.path = mkdtemp()
+        set_ckpt_path(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def run_experiment(self, config):
+        with Experiment("test", config) as ex:
+            ex.add_results("dev", [0, 1, 1, 0], [0, 1, 0, 0])
+
+    def test_lazy_results(self):
+        self.run_experiment({"a": 1})
+
+        with ExperimentIndex() as index:
+            ex_id, = index.get_ids()
+            data = index.load(ex_id)
+
+            self.assertEqual(data['config'], {"a": 1})
+            self.assertEqual(list(data['results']), ["dev"])
+            self.assertIsNone(data['results'].arrays)
+
+            self.assertEqual(list(data['results']['dev']['y_pred']),
+                             [0, 1, 0, 0])
+
+    def test_results_file(self):
+        import numpy as np
+
+        y_pred = np.arange(1000, dtype=np.float32)
+
+        with Experiment("test", {"a": 1}) as ex:
+            ex.add_results("dev", np.arange(1000), y_pred)
+            ex.add_results("test", [0, 1], [1, 1])
+
+        with ExperimentIndex() as index:
+            ex_id, = index.get_ids()
+            results = index.load(ex_id)['results']
+
+            self.assertEqual(results.filename.rsplit(".", 1)[1], "results")
+            self.assertTrue(np.array_equal(results['dev']['y_pred'], y_pred))
+            self.assertEqual(results['dev']['y_pred'].dtype, np.float32)
+            self.assertEqual(list(results['test']['y_true']), [0, 1])
+
+            # Arrays are mapped from the file, not copied
+            self.assertFalse(results['dev']['y_true'].flags.writeable)
+
+    def test_ragged_results(self):
+        with Experiment("test", {"a": 1}) as ex:
+            ex.add_results("dev", [[0, 1], [2]], [[0], [1, 2]])
+
+        with ExperimentIndex() as index:
+            ex_id, = index.get_ids()
+            results = index.load(ex_id)['results']
+
+            self.assertEqual(results['dev']['y_true'], [[0, 1], [2]])
+
+    def test_header_types(self):
+        import json
+        import numpy as np
+
+        config = OrderedDict([
+            ("vectorizer", {"ngram_range": (1, 2),
+                            "min_df": np.int64(2),
+                            "dtype": np.float32}),
+            ("model", OrderedDict([("class_weight", {0: 1.0, 1: 2.5}),
+                                   ("alpha", 0.1)]))])
+
+        with Experiment("test", config) as ex:
+            with profile("stage", "fit"):
+                ex.add_results("dev", [0, 1], [1, 1])
+
+        os.remove(os.path.join(self.path, "index.sqlite"))
+
+        with ExperimentIndex() as index:
+            index.sync()
+            ex_id, = index.get_ids()
+
+            for data in (index.get(ex_id), index.load(ex_id)):
+                loaded = data['config']
+
+                self.assertEqual(loaded, config)
+                self.assertEqual(loaded['vectorizer']['ngram_range'], (1, 2))
+                self.assertEqual(type(loaded['vectorizer']['min_df']),
+                                 np.int64)
+
+            with open(index.get_filename(ex_id)) as fd:
+                header = json.load(fd)
+
+        # Dicts, ordered ones and profile records included, are plain
+        # JSON in the header
+        self.assertEqual(list(header['config']), ["vectorizer", "model"])
+        self.assertEqual(header['config']['model']['alpha'], 0.1)
+
+        record, = header['metadata']['profile']
+        self.assertEqual((record['name'], record['event']), ("stage", "fit"))
+        self.assertIsInstance(record['wall'], float)
@@ -0,0 +1,106 @@
+from unittest import TestCase
+from unittest.mock import patch
+from tempfile import mkdtemp
+
+import os
+import json
+import shutil
+
+from ckpt.sweep import expand_grid, build_tree, run_sweep
+from ckpt.pipeline import Pipeline
+from ckpt.misc import set_ckpt_path
+from ckpt.argparse import Parser
+
+from .test_pipeline import Scale, Shift, Mean, calls
+
+class FailingShift(Shift):
+    def fit(self, X, y):
+        if self.factor == 3:
+            raise ValueError()
+
+        super().fit(X, y)
+
+pipes = {"scale": Scale, "shift": Shift, "mean": Mean}
+
+grid = {"scale": {"factor": [2]},
+        "shift": {"factor": [1, 3]},
+        "mean": {"offset": [0, 1, 2]}}
+
+def load_data():
+    return [1, 2, 3], None
+
+def run(config):
+    X, y = load_data()
+    Pipeline.from_dict(config, pipes).fit(X, y)
+
+def fail(config):
+    raise ValueError()
+
+class TestSweep(TestCase):
+    def setUp(self):
+        self.path = mkdtemp()
+        set_ckpt_path(self.path)
+        del calls[:]
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_tree(self):
+        configs = list(expand_grid(grid))
+
+        self.assertEqual(len(configs), 6)
+
+        root = build_tree(configs)
+        self.assertEqual(len(root.children), 1)
+
+        scale, = root.children.values()
+        self.assertEqual(len(scale.children), 2)
+
+    def test_run(self):
+        failures = run_sweep(list(expand_grid(grid)), pipes, load_data, run)
+
+        self.assertEqual(failures, [])
+        self.assertEqual(calls.count(("fit", "Scale")), 1)
+        self.assertEqual(calls.count(("fit", "Shift")), 2)
+        self.assertEqual(calls.count(("fit", "Mean")), 6)
+
+    def test_parallel(self):
+        configs = list(expand_grid(grid))
+
+        self.assertEqual(run_sweep(configs, pipes, load_data, run, jobs=2),
+                         [])
+
+        failures = run_sweep(configs, pipes, load_data, fail, jobs=2)
+        self.assertEqual(len(failures), 6)
+
+    def test_failed_stage(self):
+        failures = run_sweep(list(expand_grid(grid)),
+                             dict(pipes, shift=FailingShift), load_data, run)
+
+        # Only the configs depending on the failed stage
+        self.assertEqual(len(failures), 3)
+        self.assertTrue(all(config['shift']['factor'] == 3
+                            for config, _ in failures))
+
+    def test_no_checkpoints(self):
+        run_sweep(list(expand_grid(grid)), pipes, load_data, run,
+                  use_checkpoints=False)
+
+        self.assertEqual(calls.count(("fit", "Scale")), 6)
+        self.assertFalse(os.path.exists(os.path.join(self.path,
+                                                     "checkpoints")))
+
+    def test_command(self):
+        filename = os.path.join(self.path, "grid.json")
+
+        with open(filename, "w") as fd:
+            json.dump({"grid": grid}, fd)
+
+        with patch("sys.argv", ["ckpt", "run", filename, "--jobs", "2",
+                                "--repeat", "2"]):
+            with self.assertRaises(SystemExit) as cm:
+                Parser().run(pipes, load_data, run)
+
+        self.assertEqual(cm.exception.code, 0)
+        self.assertEqual(len(os.listdir(os.path.join(self.path,
+                                                     "checkpoints"))), 1 + 2 + 6)
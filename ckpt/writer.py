@@ -0,0 +1,154 @@
+import os
+import sys
+import atexit
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger("ckpt.writer")
+
+class CheckpointWriter(object):
+    """Saves checkpoints on a pool of background threads.
+
+    At most `max_pending` saves are queued or running at a time, so
+    models waiting to be written don't pile up in memory. A failed save
+    is raised on the main thread by the next call to `submit`, `wait`
+    or `flush`.
+    """
+
+    def __init__(self, workers=1, max_pending=4):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pid = os.getpid()
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix="ckpt-writer")
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.pending = {}
+        self.errors = []
+        self.lock = threading.Lock()
+
+    def submit(self, ckpt, save):
+        """Run `save(ckpt)` in the background and publish the checkpoint
+        when done. `ckpt` must be entered, and is detached from the
+        caller's with-block."""
+        self.raise_errors()
+        self.slots.acquire()
+
+        detached = ckpt.detach()
+        key = detached.get_hash()
+
+        try:
+            future = self.executor.submit(self._save, detached, save)
+        except BaseException:
+            self.slots.release()
+            detached.__exit__(*sys.exc_info())
+            raise
+
+        with self.lock:
+            self.pending[key] = future
+
+        future.add_done_callback(lambda _: self._done(key, future))
+
+        return future
+
+    def _save(self, ckpt, save):
+        try:
+            save(ckpt)
+        except BaseException:
+            ckpt.__exit__(*sys.exc_info())
+            raise
+
+        ckpt.__exit__(None, None, None)
+
+    def _done(self, key, future):
+        with self.lock:
+            if self.pending.get(key) is future:
+                del self.pending[key]
+
+            if future.exception() is not None:
+                self.errors.append(future.exception())
+
+        self.slots.release()
+
+    def raise_errors(self):
+        with self.lock:
+            if not self.errors:
+                return
+
+            error = self.errors.pop(0)
+
+        raise error
+
+    def wait(self, ckpt_hash):
+        """Wait for a pending save of the checkpoint `ckpt_hash`."""
+        with self.lock:
+            future = self.pending.get(ckpt_hash)
+
+        if future is not None:
+            future.exception()
+
+        self.raise_errors()
+
+    def flush(self):
+        """Wait for all pending saves."""
+        with self.lock:
+            futures = list(self.pending.values())
+
+        for future in futures:
+            future.exception()
+
+        self.raise_errors()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown()
+
+writer = None
+
+def enable_async_writes(workers=1, max_pending=4):
+    """Save fitted models in the background, so the pipeline goes on
+    with the next stage while the checkpoint is serialised and
+    compressed. The model is snapshotted in memory before the save is
+    queued, see `Pipe._save_later`."""
+    global writer
+
+    disable_async_writes()
+    writer = CheckpointWriter(workers, max_pending)
+
+    return writer
+
+def disable_async_writes():
+    global writer
+
+    if writer is not None and writer.pid == os.getpid():
+        writer, closing = None, writer
+        closing.close()
+
+    writer = None
+
+def get_writer():
+    global writer
+
+    # Writer threads don't survive a fork
+    if writer is not None and writer.pid != os.getpid():
+        writer = CheckpointWriter(writer.workers, writer.max_pending)
+
+    return writer
+
+def wait_for(ckpt_hash):
+    if writer is not None and writer.pid == os.getpid():
+        writer.wait(ckpt_hash)
+
+def flush_writes():
+    if writer is not None and writer.pid == os.getpid():
+        writer.flush()
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush_writes()
+    except Exception:
+        logger.exception("Saving checkpoint failed")